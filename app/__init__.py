@@ -5,6 +5,8 @@ from flask_login import LoginManager
 
 from .models import db, Users
 from .routes import bp as main_bp
+from .commands import add_places_command, backfill_command, ingest_command, load_archive_command, warm_summaries_command
+from .api.ingestion import start_ingestion_on_first_request
 
 # initialize the login manager that will handle the authentication and authorization
 login_manager = LoginManager()
@@ -34,5 +36,17 @@ def create_app():
     # register the main blueprint from routes.py to the application
     app.register_blueprint(main_bp)
 
+    # register the cli commands (flask --app run <command>)
+    app.cli.add_command(ingest_command)
+    app.cli.add_command(load_archive_command)
+    app.cli.add_command(warm_summaries_command)
+    app.cli.add_command(backfill_command)
+    app.cli.add_command(add_places_command)
+
+    # poll phivolcs in the background of this process once it serves requests, if enabled
+    # a separate `flask --app run ingest` process can be used instead (INGESTION_THREAD=0)
+    if app.config["INGESTION_THREAD"]:
+        start_ingestion_on_first_request(app, app.config["INGESTION_INTERVAL"])
+
     return app
 
@@ -0,0 +1,239 @@
+import asyncio
+import calendar
+import json
+import logging
+import os
+import random
+from datetime import date, datetime, timedelta
+from urllib.parse import urljoin, urlparse
+import httpx
+from .client import BASE_URL, HEADERS, TIMEOUT
+from .parsers import iter_earthquakes
+from .phivolcs import GEOJSON_DAYS, parse_bulletin, publish_geojson
+from ..catalog import load_bulletins, save_bulletins, upsert_earthquakes
+
+"""
+Historical backfill of the catalog from the PHIVOLCS monthly archive pages (and their bulletins).
+The main page only lists the latest earthquakes; every month also has its own page, in the same table markup:
+    EQLatest-Monthly/2025/2025_October.html
+linking to the bulletins of the month (2025_Earthquake_Information/October/...).
+
+1. pages and bulletins are fetched with asyncio (httpx), at most `concurrency` requests at a time
+2. failed requests (connection errors, 429 and 5xx) are retried with exponential backoff and jitter
+3. earthquakes are bulk upserted into the catalog, bulletin details are stored in batches
+4. a month is written to the checkpoint file once complete, so an interrupted backfill resumes where it stopped
+   (bulletins already stored are never fetched again, even inside a month that was not complete)
+
+The catalog keeps the links of the upstream of the app (client.BASE_URL, PHIVOLCS_BASE_URL), whatever server
+is crawled (base_url), so a local stand-in of the site (benchmarks/fake_phivolcs.py) gives the same catalog
+as phivolcs itself.
+"""
+
+logger = logging.getLogger(__name__)
+
+# path of a monthly archive page
+MONTHLY_PAGE = "EQLatest-Monthly/{year}/{year}_{month}.html"
+
+# maximum number of requests in flight, and of months crawled at the same time
+CONCURRENCY = 8
+MONTH_CONCURRENCY = 2
+
+# retries of a failed request, waiting BACKOFF seconds before the first retry and doubling every time
+RETRIES = 4
+BACKOFF = 1.0 # seconds
+
+# responses that are worth retrying (rate limited, or server errors)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# number of bulletins fetched before storing them (the unit of progress inside a month)
+BULLETIN_BATCH = 200
+
+# default checkpoint file (repository root)
+CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), "../../backfill-checkpoint.json")
+
+
+# (year, month) pairs from start to end, both included
+def months_between(start, end):
+    year, month = start
+    while (year, month) <= end:
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+# first moment after a month
+def month_end(year, month):
+    return datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+
+
+def monthly_url(base_url, year, month):
+    return urljoin(base_url, MONTHLY_PAGE.format(year=year, month=calendar.month_name[month]))
+
+
+# months already backfilled, as "YYYY-MM" keys
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, encoding="utf-8") as f:
+        return set(json.load(f)["months"])
+
+
+def write_checkpoint(path, months):
+    # write a temporary file first, so an interruption never leaves a broken checkpoint
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"months": sorted(months)}, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+# asynchronous http client with bounded concurrency and retries
+class Fetcher:
+    def __init__(self, base_url=BASE_URL, concurrency=CONCURRENCY):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # phivolcs is fetched without ssl verification, same as client.py
+        self.client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=TIMEOUT,
+            verify=False,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    # url of a phivolcs link on the crawled server
+    def url_of(self, link):
+        return urljoin(self.base_url, urlparse(link).path.lstrip("/"))
+
+    # text of a page, or None if it does not exist (404); raises once the retries are used up
+    async def get(self, url):
+        for attempt in range(RETRIES + 1):
+            wait = BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+
+            try:
+                async with self.semaphore:
+                    response = await self.client.get(url)
+
+                if response.status_code == 404:
+                    return None
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.text
+
+                error = f"status {response.status_code}"
+                # the server may tell how long to wait
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    wait = max(wait, int(retry_after))
+
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+
+            if attempt == RETRIES:
+                raise RuntimeError(f"{url}: {error} (after {RETRIES} retries)")
+
+            # wait outside the semaphore, so the other requests keep going
+            await asyncio.sleep(wait)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def fetch_bulletin(fetcher, detail_link):
+    html = await fetcher.get(fetcher.url_of(detail_link))
+    if html is None:
+        return None
+
+    # parsing is cpu work, keep it off the event loop
+    return await asyncio.to_thread(parse_bulletin, html)
+
+
+# backfill one month: returns {"earthquakes", "bulletins", "failed", "missing", "found"}
+# missing bulletins (404) are skipped for good, failed ones are fetched again by the next run
+# needs an app context for the database
+async def backfill_month(fetcher, year, month, bulletins=True):
+    stats = {"earthquakes": 0, "bulletins": 0, "failed": 0, "missing": 0, "found": False}
+
+    html = await fetcher.get(monthly_url(fetcher.base_url, year, month))
+    if html is None:
+        return stats
+
+    earthquakes = await asyncio.to_thread(lambda: list(iter_earthquakes(html)))
+    stats["found"] = True
+    stats["earthquakes"] = upsert_earthquakes(earthquakes)
+
+    if not bulletins:
+        return stats
+
+    # only the bulletins that are not stored yet
+    links = sorted({earthquake.detail_link for earthquake in earthquakes if earthquake.detail_link})
+    stored = load_bulletins(links)
+    missing = [link for link in links if link not in stored]
+
+    for start in range(0, len(missing), BULLETIN_BATCH):
+        batch = missing[start:start + BULLETIN_BATCH]
+        results = await asyncio.gather(*(fetch_bulletin(fetcher, link) for link in batch), return_exceptions=True)
+
+        details = {}
+        for link, result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.warning("bulletin fetch failed for %s: %s", link, result)
+                stats["failed"] += 1
+            elif result is None:
+                stats["missing"] += 1
+            else:
+                details[link] = result
+
+        save_bulletins(details)
+        stats["bulletins"] += len(details)
+
+    return stats
+
+
+# backfill the months from start to end ((year, month) pairs), skipping the months of the checkpoint
+# report(key, stats) is called after every month, stats is None for a month skipped by the checkpoint
+# and {"error": message} for a month that failed; returns the keys of the months completed by this run
+# needs an app context for the database
+async def run_backfill(start, end, base_url=BASE_URL, concurrency=CONCURRENCY, checkpoint_path=CHECKPOINT_PATH,
+                       bulletins=True, report=None):
+    report = report or (lambda key, stats: None)
+    done = read_checkpoint(checkpoint_path)
+    completed = []
+
+    fetcher = Fetcher(base_url, concurrency)
+    month_limit = asyncio.Semaphore(MONTH_CONCURRENCY)
+    today = date.today()
+
+    async def backfill_one(year, month):
+        key = f"{year}-{month:02d}"
+        if key in done:
+            report(key, None)
+            return
+
+        async with month_limit:
+            try:
+                stats = await backfill_month(fetcher, year, month, bulletins)
+            except Exception as e:
+                report(key, {"error": str(e)})
+                return
+
+        # the catalog changed (its version was bumped by the upsert): publish the map feed again
+        # if the month is in its window, so the map does not wait for the next new earthquake
+        if stats["earthquakes"] and month_end(year, month) >= datetime.now() - timedelta(days=GEOJSON_DAYS):
+            publish_geojson()
+
+        # a month with failed bulletins, missing, or still running (its page still grows) is crawled again by the next run
+        if stats["found"] and stats["failed"] == 0 and (year, month) < (today.year, today.month):
+            done.add(key)
+            completed.append(key)
+            write_checkpoint(checkpoint_path, done)
+        report(key, stats)
+
+    try:
+        await asyncio.gather(*(backfill_one(year, month) for year, month in months_between(start, end)))
+    finally:
+        await fetcher.close()
+
+    return completed
+
+
+def backfill(*args, **kwargs):
+    return asyncio.run(run_backfill(*args, **kwargs))
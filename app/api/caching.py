@@ -1,15 +1,129 @@
 import redis
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from ..metrics import count_cache, timed
 
 """
 Redis caching will be used for the following services:
 1. Earthquake view (Map)
 2. Earthquake AI Summary (Gemini API)
+
+Values are cached in two tiers:
+1. a small in-process LRU (per worker), so hot keys are served from memory without a redis round trip
+2. redis, shared by all workers
+Large values are compressed before being sent to redis.
+
+A value that is expensive to compute (an ai summary) has a redis lock per key (acquire_lock):
+one caller takes it and computes, the others wait for the result (wait).
 """
 
 # initialize the redis object using localhost
 redis_client = redis.Redis(host="localhost", port=6379, db=0)
 
-# create Cache class 
+# limits of the in-process cache: number of values, total size, and how long a value is trusted without asking redis
+LOCAL_MAX_ITEMS = 256
+LOCAL_MAX_BYTES = 32 * 1024 * 1024
+LOCAL_TTL = 30 # seconds
+
+# values larger than this are compressed in redis
+COMPRESS_MIN_SIZE = 4 * 1024 # bytes
+
+# prefix of compressed values in redis (plain values are utf-8 text, which never starts with a null byte)
+COMPRESSED_PREFIX = b"\x00zlib\x00"
+
+
+# how long a computation may hold the lock before another caller may take over
+LOCK_TTL = 60 # seconds
+
+# how long other callers wait for the lock holder's result, and how often they check
+WAIT_TIMEOUT = 30 # seconds
+WAIT_INTERVAL = 0.1 # seconds
+
+# release a lock only if it is still held by the caller (another caller may have taken it after it expired)
+release_lock_script = redis_client.register_script("""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+""")
+
+
+# in-process LRU cache with size- and time-based eviction
+class LocalCache:
+    def __init__(self, max_items=LOCAL_MAX_ITEMS, max_bytes=LOCAL_MAX_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key: (value, expiry time, size), least recently used first
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+
+            # drop the value once expired
+            if item[1] <= time.monotonic():
+                self.remove(key)
+                return None
+
+            # mark as most recently used
+            self.items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl):
+        size = len(value)
+        # never keep a value that would take most of the cache
+        if size > self.max_bytes // 4:
+            return
+
+        with self.lock:
+            self.remove(key)
+            self.items[key] = (value, time.monotonic() + ttl, size)
+            self.size += size
+
+            # evict the least recently used values until within limits
+            while len(self.items) > self.max_items or self.size > self.max_bytes:
+                self.remove(next(iter(self.items)))
+
+    # remove a key (the lock must be held)
+    def remove(self, key):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= item[2]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+# in-process cache shared by all Cache objects of this worker
+local_cache = LocalCache()
+
+
+# encode a value for redis, compressing it if large
+def encode(data):
+    data = data.encode('utf-8')
+    if len(data) >= COMPRESS_MIN_SIZE:
+        return COMPRESSED_PREFIX + zlib.compress(data, 6)
+    return data
+
+
+# decode a value from redis
+# note: no need for proper encrypting/decrypting for now since all is public data
+def decode(data):
+    if data.startswith(COMPRESSED_PREFIX):
+        data = zlib.decompress(data[len(COMPRESSED_PREFIX):])
+    return data.decode('utf-8')
+
+
+# create Cache class
 class Cache:
     # for initializing a Cache object, accept key and time to live (expiry)
     def __init__(self, key, ttl=60):
@@ -19,21 +133,58 @@ class Cache:
 
     # function for retrieving the data using key
     def get(self):
+        # serve from the in-process cache if possible
+        data = local_cache.get(self.key)
+        count_cache("local", data is not None)
+        if data is not None:
+            return data
+
         # retrieve data using key
-        data = self.redis_client.get(self.key)
+        with timed("redis_get"):
+            data = self.redis_client.get(self.key)
+        count_cache("redis", data is not None)
 
         # if data exists, return its decoded version
-        # note: no need for proper encrypting/decrypting for now since all is public data
         if data is not None:
-            return data.decode('utf-8')
-        
+            data = decode(data)
+            local_cache.set(self.key, data, min(self.ttl, LOCAL_TTL))
+            return data
+
         # else, return None
         return None
-    
+
     # function for setting/storing the data in the cache
     def set(self, data):
-        # store the data using the key and data 
-        self.redis_client.set(self.key, data)
-        # set the cache duration using ttl value
-        self.redis_client.expire(self.key, self.ttl)
+        encoded = encode(data)
+
+        # store the data using the key and data, with the cache duration (ttl) in the same command
+        with timed("redis_set"):
+            self.redis_client.set(self.key, encoded, ex=self.ttl)
+
+        local_cache.set(self.key, data, min(self.ttl, LOCAL_TTL))
+
+    # function for waiting for the caller holding the compute lock: returns its result once stored,
+    # or None if the lock was released without a result (or still held after the timeout)
+    def wait(self, timeout=WAIT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            data = self.get()
+            if data is not None:
+                return data
+            if not self.redis_client.exists(f"{self.key}:lock"):
+                return self.get()
+            time.sleep(WAIT_INTERVAL)
+
+        return None
+
+    # function for taking the compute lock of the key; returns a token to release it, or None if somebody else holds it
+    def acquire_lock(self, ttl=LOCK_TTL):
+        token = uuid.uuid4().hex
+        if self.redis_client.set(f"{self.key}:lock", token, nx=True, ex=ttl):
+            return token
+        return None
 
+    # function for releasing the compute lock, only if still held with the token
+    def release_lock(self, token):
+        release_lock_script(keys=[f"{self.key}:lock"], args=[token])
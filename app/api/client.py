@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from ..metrics import count_cache, timed
+
+"""
+Shared HTTP client for every request to the PHIVOLCS website (main page and bulletins).
+1. one pooled session, so connections (and their TLS handshakes) are reused
+2. conditional GETs (ETag / If-Modified-Since), so an unchanged page costs a 304
+3. a body hash, so an unchanged page without validators costs a hash compare instead of a reparse
+"""
+
+# set the base url for api calls; PHIVOLCS_BASE_URL points the app to another server,
+# e.g. the local stand-in of benchmarks/fake_phivolcs.py for load tests
+BASE_URL = os.getenv("PHIVOLCS_BASE_URL", 'https://earthquake.phivolcs.dost.gov.ph/').rstrip("/") + "/"
+
+# headers sent with every request (same from original server.js)
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': "keep-alive",
+}
+
+# timeout after 10 seconds of no connection
+TIMEOUT = 10 # seconds
+
+# phivolcs is fetched without ssl verification on purpose, so silence the warning printed on every request
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# initialize one session for the whole process, with a keep-alive connection pool
+session = requests.Session()
+session.headers.update(HEADERS)
+session.verify = False
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+# validators of the last response per url (etag, last-modified, body hash)
+validators = {}
+validators_lock = threading.Lock()
+
+
+# result of a fetch; text is None when the page did not change since the last fetch
+# validators are the ones of this response, kept for the next fetch only once save_validators() is called
+class FetchResult:
+    def __init__(self, url, text, changed, validators=None):
+        self.url = url
+        self.text = text
+        self.changed = changed
+        self.validators = validators
+
+
+def fetch(url, conditional=True):
+    headers = {}
+
+    # ask the server to answer 304 if the page did not change since the last fetch
+    with validators_lock:
+        previous = validators.get(url) if conditional else None
+    if previous:
+        if previous["etag"]:
+            headers["If-None-Match"] = previous["etag"]
+        if previous["last_modified"]:
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    with timed("fetch"):
+        res = session.get(url, headers=headers, timeout=TIMEOUT)
+
+    # the server confirmed that nothing changed, nothing was downloaded
+    if res.status_code == 304 and previous:
+        count_cache("http_validators", True)
+        return FetchResult(url, None, False)
+
+    res.raise_for_status()
+
+    # the server does not support validators (or ignored them), so compare the body itself
+    body_hash = hashlib.sha256(res.content).hexdigest()
+
+    response_validators = {
+        "etag": res.headers.get("ETag"),
+        "last_modified": res.headers.get("Last-Modified"),
+        "hash": body_hash,
+    }
+
+    if previous and previous["hash"] == body_hash:
+        count_cache("http_validators", True)
+        return FetchResult(url, None, False, response_validators)
+
+    if conditional:
+        count_cache("http_validators", False)
+    return FetchResult(url, res.text, True, response_validators)
+
+
+# keep the validators of a fetch for the next conditional fetch of its url
+# the caller saves them only once the page was fully processed, so a failed run fetches the page again
+# instead of getting a 304 (or the same hash) for a page that was never published
+def save_validators(result):
+    if result.validators is None:
+        return
+
+    with validators_lock:
+        validators[result.url] = result.validators
@@ -0,0 +1,112 @@
+import json
+import logging
+import queue
+import threading
+import time
+from .caching import redis_client
+from ..metrics import event_clients
+
+"""
+Live push of new earthquakes to the dashboards.
+1. the ingestion worker publishes the new earthquakes of every scrape on a redis channel (publish_earthquakes)
+2. every app process runs ONE subscriber thread on that channel (Broadcaster), started by the first connected browser
+3. the subscriber hands every message to the queue of each browser connected to this process,
+   and /api/events/stream sends it as a server-sent event
+
+So redis load grows with the number of processes and the rate of earthquakes, not with the number of browsers,
+and browsers learn about a new earthquake within seconds of the scrape, without polling.
+Every connected browser holds one server thread, so the stream is off unless LIVE_EVENTS is set (config.py),
+which needs a threaded (or gevent) server, and each process accepts at most LIVE_EVENTS_MAX_CLIENTS browsers.
+"""
+
+logger = logging.getLogger(__name__)
+
+# redis channel of the new earthquakes
+CHANNEL = "phivolcs-events"
+
+# maximum number of earthquakes per message (the newest ones), e.g. after a long outage of the worker
+MAX_EARTHQUAKES = 20
+
+# messages kept for a browser that reads slowly; older messages are dropped when full
+CLIENT_QUEUE_SIZE = 16
+
+# wait before subscribing again after the redis connection failed
+RECONNECT_DELAY = 5 # seconds
+
+
+# publish the new earthquakes of a scrape (newest first) to every connected dashboard
+def publish_earthquakes(earthquakes, last_updated):
+    if not earthquakes:
+        return 0
+
+    message = json.dumps({"earthquakes": earthquakes[:MAX_EARTHQUAKES], "last_updated": last_updated})
+    return redis_client.publish(CHANNEL, message)
+
+
+# one subscriber per process, fanning the messages out to the connected browsers
+class Broadcaster:
+    def __init__(self, channel=CHANNEL):
+        self.channel = channel
+        # one queue per connected browser
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # register a browser; returns the queue its messages arrive in, or None if max_clients are already connected
+    def subscribe(self, max_clients=None):
+        client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+
+        with self.lock:
+            if max_clients is not None and len(self.clients) >= max_clients:
+                return None
+
+            self.clients.add(client)
+            event_clients.inc()
+
+            # start the subscriber thread with the first browser
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="phivolcs-events", daemon=True)
+                self.thread.start()
+
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+                event_clients.dec()
+
+    # hand a message to every connected browser
+    def broadcast(self, message):
+        with self.lock:
+            clients = list(self.clients)
+
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # the browser is not reading: drop its oldest message, it gets the newest one
+                try:
+                    client.get_nowait()
+                    client.put_nowait(message)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    # subscriber loop: listen forever, subscribing again if the connection to redis is lost
+    def run(self):
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.broadcast(message["data"].decode("utf-8"))
+
+            except Exception as e:
+                logger.warning("event subscriber failed: %s", e)
+                time.sleep(RECONNECT_DELAY)
+
+
+# subscriber of this process
+broadcaster = Broadcaster()
@@ -1,72 +1,172 @@
+import hashlib
+import json
 import os
-import redis
+import threading
+import time
 from google import genai
 from google.genai import types, errors
 from dotenv import load_dotenv
 from .caching import Cache
+from ..catalog import stored_summary_keys, load_summary, save_summary
+from ..metrics import count_cache, observe, timed
 
 
-def generate_summary(data: dict) -> dict:
+# set the model used for the summaries
+MODEL = "gemini-2.0-flash" # best least busy model
+
+# set magnitude condition prompt for ai
+MAGNITUDE_CONDITION = (
+    "Only if the magnitude is 4.0 or higher, "
+    "Include 2 short, simple, and relevant safety tips for the affected areas."
+    "Also report the additional details included in the official bulletin report"
+    "Additional reports to refer to:" \
+    "1. Reported Intensities" \
+    "2. Expected Damages?" \
+    "3. Expected Aftershocks?"
+)
+
+# set the ai's general role and instruction
+# this context will be used by the ai for all messages
+SYSTEM_INSTRUCTION = (
+    "You are an AI assistant that summarizes PHIVOLCS earthquake reports. "
+    "Your tone should be calm, and formal but still easy-to-digest — as if you’re explaining the situation to everyday Filipinos. "
+    "Avoid technical jargon, but keep the facts accurate. Avoid greetings as well -- just straight to the report."
+    "Never use decorations (like bold, italics, headers, or bullets). "
+    "Respond in plain text only."
+)
+
+# bulletin fields that are fed into the ai
+SUMMARY_FIELDS = [
+    "date_time", "latitude", "longitude", "depth", "magnitude", "location",
+    "reported_intensities", "expected_damage", "expected_aftershocks",
+]
 
-    # set the program's .env path string from this file (in the root directory)
-    env_path = os.path.join(os.path.dirname(__file__), '../../.env')
-    
-    # set the programm's .env using the path created
-    load_dotenv(dotenv_path=env_path)
-
-    # get the gemini api key
-    api_key = os.getenv("GEMINI_API_KEY")
-
-    # connect to gemini client using api key
-    client = genai.Client(api_key=api_key)
-
-    # set magnitude condition prompt for ai
-    magnitude_condition = (
-        "Only if the magnitude is 4.0 or higher, "
-        "Include 2 short, simple, and relevant safety tips for the affected areas."
-        "Also report the additional details included in the official bulletin report"
-        "Additional reports to refer to:" \
-        "1. Reported Intensities" \
-        "2. Expected Damages?" \
-        "3. Expected Aftershocks?"
-    )
 
-    # set the ai's general role and instruction
-    # this context will be used by the ai for all messages
-    system_instruction = (
-        "You are an AI assistant that summarizes PHIVOLCS earthquake reports. "
-        "Your tone should be calm, and formal but still easy-to-digest — as if you’re explaining the situation to everyday Filipinos. "
-        "Avoid technical jargon, but keep the facts accurate. Avoid greetings as well -- just straight to the report."
-        "Never use decorations (like bold, italics, headers, or bullets). "
-        "Respond in plain text only."
+# describe the earthquake sequence (cluster, see clustering.py) of an earthquake for the ai
+def describe_sequence(cluster) -> str:
+    if not cluster:
+        return "Not part of a detected earthquake sequence"
+
+    mainshock = cluster["mainshock"]
+    role = {"mainshock": "the main shock", "foreshock": "a foreshock", "aftershock": "an aftershock"}[cluster["role"]]
+    text = (
+        f"This is {role} of a sequence of {cluster['events']} earthquakes "
+        f"(main shock: magnitude {mainshock['magnitude']} on {mainshock['date_time']}, {mainshock['location']}), "
+        f"with {cluster['aftershocks']} aftershocks so far"
     )
+    if cluster["largest_aftershock"] is not None:
+        text += f", the largest of magnitude {cluster['largest_aftershock']}"
+    if cluster["decay_rate"] is not None:
+        text += f". The aftershock rate is decaying with an Omori exponent of {cluster['decay_rate']} (above 1 means it is dying down quickly)"
+    return text
 
-    # set the actual text to be fed into the ai
-    contents = (
-        "TASK:\n"
-        "Summarize the following earthquake information in exactly 5 sentences. "
-        "Make it easy to understand and reassuring in tone. "
-        f"{magnitude_condition}\n\n"
-        "EARTHQUAKE DETAILS:\n"
+
+# set the details of one earthquake to be fed into the ai
+def build_details(data: dict) -> str:
+    return (
         f"- Date and Time: {data['date_time']}\n"
         f"- Latitude: {data['latitude']}\n"
         f"- Longitude: {data['longitude']}\n"
         f"- Depth: {data['depth']}\n"
         f"- Magnitude: {data['magnitude']}\n"
         f"- Location: {data['location']}\n"
-        f"- Reported Intensities: {data['reported_intensities']}\n"
-        f"- Expected Damage: {data['expected_damage']}\n"
-        f"- Expected Aftershocks: {data['expected_aftershocks']}\n"
+        f"- Reported Intensities: {data.get('reported_intensities')}\n"
+        f"- Expected Damage: {data.get('expected_damage')}\n"
+        f"- Expected Aftershocks: {data.get('expected_aftershocks')}\n"
+        f"- Earthquake Sequence: {describe_sequence(data.get('cluster'))}\n"
+    )
+
+
+# set the actual text to be fed into the ai
+def build_contents(data: dict) -> str:
+    return (
+        "TASK:\n"
+        "Summarize the following earthquake information in exactly 5 sentences. "
+        "Make it easy to understand and reassuring in tone. "
+        f"{MAGNITUDE_CONDITION}\n\n"
+        "EARTHQUAKE DETAILS:\n"
+        f"{build_details(data)}"
+    )
+
 
+# set the text to be fed into the ai for many earthquakes in one call
+# the ai answers with a json array of summaries, one per earthquake, in the same order
+def build_batch_contents(earthquakes: list) -> str:
+    details = "\n".join(
+        f"EARTHQUAKE {number}:\n{build_details(data)}"
+        for number, data in enumerate(earthquakes, start=1)
+    )
+
+    return (
+        "TASK:\n"
+        f"Summarize each of the following {len(earthquakes)} earthquakes separately, each in exactly 5 sentences. "
+        "Make them easy to understand and reassuring in tone. "
+        f"{MAGNITUDE_CONDITION}\n"
+        "Answer with a JSON array of strings: one summary per earthquake, in the same order.\n\n"
+        f"{details}"
     )
 
+
+# set the program's .env path string from this file (in the root directory)
+# and load it once, when the module is imported
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '../../.env'))
+
+# long-lived gemini client, shared by all calls of this process (created on first use)
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+
+    with client_lock:
+        if client is None:
+            # connect to gemini client using api key
+            client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
+    return client
+
+
+# version of the prompt: a hash of the model, the instructions and the contents template
+# changing any of them in this file changes the version, which invalidates the stored summaries
+PROMPT_VERSION = hashlib.sha256("\n".join([
+    MODEL,
+    SYSTEM_INSTRUCTION,
+    build_contents({field: f"{{{field}}}" for field in SUMMARY_FIELDS}),
+    build_batch_contents([{field: f"{{{field}}}" for field in SUMMARY_FIELDS}]),
+]).encode("utf-8")).hexdigest()[:12]
+
+
+# content address of a summary: a hash of the bulletin fields and the prompt version
+# numbers are normalized, so the scraped strings ("3") and the stored floats (3.0) give the same key
+# only the identity of the earthquake sequence is part of the key (main shock and role), not its counts,
+# so a summary is not generated again for every new aftershock
+def summary_key(earthquake: dict) -> str:
+    fields = {}
+    for field in SUMMARY_FIELDS:
+        value = earthquake.get(field)
+        if field in ("latitude", "longitude", "depth", "magnitude") and value is not None:
+            value = float(value)
+        fields[field] = value
+
+    cluster = earthquake.get("cluster")
+    fields["cluster"] = [cluster["mainshock"]["detail_link"], cluster["role"]] if cluster else None
+
+    data = json.dumps([PROMPT_VERSION, fields], sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def generate_summary(data: dict) -> dict:
+    contents = build_contents(data)
+
     try:
         # send the instruction and content to gemini, and retrieve the response
-        response = client.models.generate_content(
-            model="gemini-2.0-flash", # best least busy model 
-            config=types.GenerateContentConfig(system_instruction=system_instruction),
-            contents=contents
-        )
+        with timed("gemini"):
+            response = get_client().models.generate_content(
+                model=MODEL,
+                config=types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION),
+                contents=contents
+            )
 
         # if request is successful, return success and data
         return {
@@ -81,27 +181,220 @@ def generate_summary(data: dict) -> dict:
             "error": str(e)
         }
 
-    
-# function for caching and fetching ai summary
+
+
+# generate the summaries of many earthquakes in one call
+# returns {"success": True, "data": [summary per earthquake]} or {"success": False, "error": ...}
+def generate_batch_summaries(earthquakes: list) -> dict:
+    contents = build_batch_contents(earthquakes)
+
+    try:
+        # ask for a json array of strings, so the answer can be split per earthquake
+        with timed("gemini"):
+            response = get_client().models.generate_content(
+                model=MODEL,
+                config=types.GenerateContentConfig(
+                    system_instruction=SYSTEM_INSTRUCTION,
+                    response_mime_type="application/json",
+                    response_schema=list[str],
+                ),
+                contents=contents
+            )
+
+        summaries = json.loads(response.text)
+        if not isinstance(summaries, list) or len(summaries) != len(earthquakes):
+            raise ValueError(f"expected {len(earthquakes)} summaries, got {len(summaries)}")
+
+        return {
+            "success": True,
+            "data": [str(summary) for summary in summaries]
+        }
+
+    # handle error for when request fails
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+# keep summaries in redis for a week; they never go out of date, since the key changes with the bulletin and prompt
+# redis is only the hot layer, the database keeps them permanently
+SUMMARY_TTL = 7 * 24 * 60 * 60 # seconds
+
+# minimum magnitude of the earthquakes summarized first and one by one (same as MAGNITUDE_CONDITION)
+PRIORITY_MAGNITUDE = 4.0
+
+# number of low-magnitude earthquakes summarized per model call (1 to summarize them one by one)
+BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", 5))
+
+# redis lock allowing only one summary pipeline at a time across workers (the lock of this cache key)
+PIPELINE_LOCK_KEY = "summary-pipeline"
+PIPELINE_LOCK_TTL = 10 * 60 # seconds
+
+# redis cache (hot layer) of a summary
+def summary_cache(key):
+    return Cache(f"summary-{key}", ttl=SUMMARY_TTL)
+
+
+# store a generated summary in the database and in redis
+def store_summary(key, earthquake, text):
+    save_summary(key, earthquake.get("detail_link"), PROMPT_VERSION, text)
+    summary_cache(key).set(text)
+
+
+# take the summary locks (the same ones /api/summary/stream takes) of a list of (key, earthquake)
+# returns the items to generate, without the ones being streamed or stored meanwhile, and the tokens to release
+def lock_summaries(items):
+    tokens = {}
+    for key, _ in items:
+        token = summary_cache(key).acquire_lock()
+        if token:
+            tokens[key] = token
+
+    # a stream may have stored some of them before their lock was taken
+    stored = stored_summary_keys(tokens)
+    return [(key, earthquake) for key, earthquake in items if key in tokens and key not in stored], tokens
+
+
+# release the summary locks taken by lock_summaries
+def unlock_summaries(tokens):
+    for key, token in tokens.items():
+        summary_cache(key).release_lock(token)
+
+
+# generate and store the summaries of a list of (key, earthquake) in one model call, or one by one
+# (a single earthquake, or the batch failed); returns the number of summaries generated
+def generate_summaries(items):
+    if len(items) > 1:
+        data = generate_batch_summaries([earthquake for _, earthquake in items])
+        if data["success"]:
+            for (key, earthquake), text in zip(items, data["data"]):
+                store_summary(key, earthquake, text)
+            return len(items)
+
+    generated = 0
+    for key, earthquake in items:
+        data = generate_summary(earthquake)
+        if data["success"]:
+            store_summary(key, earthquake, data["data"])
+            generated += 1
+    return generated
+
+
+# pipeline stage: summarize the earthquakes that have no stored summary yet, ahead of any request
+# big earthquakes (M4.0+) are summarized first, one by one; the others in batches of BATCH_SIZE
+# only earthquakes with their bulletin details are summarized (the details are part of the summary key)
+# every summary is generated under its own lock, so a summary being streamed to a dashboard is not generated twice
+# needs an app context for the database; returns the number of summaries generated
+def summarize_earthquakes(earthquakes):
+    # allow only one pipeline at a time, so two workers do not summarize the same earthquakes
+    pipeline_lock = Cache(PIPELINE_LOCK_KEY)
+    pipeline_token = pipeline_lock.acquire_lock(PIPELINE_LOCK_TTL)
+    if pipeline_token is None:
+        return 0
+
+    try:
+        pending = {}
+        for earthquake in earthquakes:
+            if "reported_intensities" in earthquake:
+                pending.setdefault(summary_key(earthquake), earthquake)
+
+        # skip the earthquakes that already have a summary
+        for key in stored_summary_keys(pending):
+            del pending[key]
+
+        # biggest earthquakes first
+        ordered = sorted(pending.items(), key=lambda item: float(item[1]["magnitude"]), reverse=True)
+        priority = [item for item in ordered if float(item[1]["magnitude"]) >= PRIORITY_MAGNITUDE]
+        rest = [item for item in ordered if float(item[1]["magnitude"]) < PRIORITY_MAGNITUDE]
+
+        # big earthquakes one by one, the others in batches
+        batches = [[item] for item in priority]
+        batches += [rest[start:start + max(BATCH_SIZE, 1)] for start in range(0, len(rest), max(BATCH_SIZE, 1))]
+
+        generated = 0
+
+        for batch in batches:
+            items, tokens = lock_summaries(batch)
+            try:
+                if items:
+                    generated += generate_summaries(items)
+            finally:
+                unlock_summaries(tokens)
+
+        return generated
+
+    finally:
+        # only release the lock if still ours (it may have expired and been taken by another worker)
+        pipeline_lock.release_lock(pipeline_token)
+
+
+# function for fetching a stored ai summary (redis, then the database), or None if it is not generated yet
+# a request never waits on the model: the dashboard streams a missing summary with stream_summary
+# needs an app context for the database
 def fetch_summary(earthquake):
-    # cache key is the detail link of the bulletin
-    # such that, the same summary for an earthquake is consistent among all users
-    cache = Cache(f"{earthquake['detail_link']}-summary")
+    # cache key is the content address of the bulletin and prompt
+    # such that, the same summary for an earthquake is consistent among all users, and survives restarts
+    key = summary_key(earthquake)
+    cache = summary_cache(key)
+
     data = cache.get()
+    if data is None:
+        data = load_summary(key)
+        count_cache("summary_db", data is not None)
+        if data is not None:
+            cache.set(data)
+    return data
+
+
+# stream the summary of an earthquake as text chunks, as soon as the model writes them
+# a stored summary is sent as one chunk; the streamed text is stored once complete
+# only one caller streams from the model at a time, the others wait for its result
+# needs an app context for the database
+def stream_summary(earthquake):
+    key = summary_key(earthquake)
+    cache = summary_cache(key)
 
-    # if cached data exists, return it
+    data = fetch_summary(earthquake)
     if data is not None:
-        return data
-    
-    # else, generate data 
-    data = generate_summary(earthquake)
+        yield data
+        return
+
+    token = cache.acquire_lock()
+
+    # somebody else is generating this summary: wait for it, then send it whole
+    if token is None:
+        data = cache.wait() or load_summary(key)
+        if data is None:
+            raise RuntimeError("the summary could not be generated, please try again")
+        yield data
+        return
 
-    # check if data returns true or false in success
+    try:
+        # send the instruction and content to gemini, and stream the response
+        chunks = []
+        stream = get_client().models.generate_content_stream(
+            model=MODEL,
+            config=types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION),
+            contents=build_contents(earthquake)
+        )
+        # time only the model, not the time the client takes to read the chunks
+        elapsed = 0
+        started = time.perf_counter()
+        for chunk in stream:
+            elapsed += time.perf_counter() - started
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+            started = time.perf_counter()
+        observe("gemini", elapsed + time.perf_counter() - started)
 
-    # return the actual data if successful
-    if data["success"]:
-        cache.set(data["data"])
-        return data["data"]
+        # an empty answer (e.g. a blocked response) is not a summary: never store it, so the next request retries
+        text = "".join(chunks)
+        if not text:
+            raise RuntimeError("the model returned an empty summary, please try again")
+        store_summary(key, earthquake, text)
 
-    # else, return an error string
-    return f"Error generating earthquake summary. Please refer to the original bulletin for details. error: {data['error']}"
\ No newline at end of file
+    finally:
+        cache.release_lock(token)
@@ -0,0 +1,141 @@
+import logging
+import os
+import socket
+import threading
+from flask import current_app
+from .caching import Cache, redis_client
+from .googleai import summarize_earthquakes
+from .phivolcs import refresh_snapshot
+from ..gazetteer import add_missing_places
+from ..models import db
+
+"""
+Ingestion worker for the PHIVOLCS feed.
+The worker polls phivolcs on a fixed interval and publishes a snapshot to redis (see phivolcs.refresh_snapshot).
+Requests only read that snapshot, so their latency never depends on phivolcs.
+
+The worker can run in two ways:
+1. as its own process: `flask --app run ingest`
+2. as a daemon thread inside every app process that serves requests (INGESTION_THREAD config),
+   started by its first request, so cli commands and the parent process of the reloader never poll
+Either way, redis locks make sure only one scrape happens per interval, and never two at once, no matter how many workers are running,
+and the threads stand by while a dedicated `ingest` process is running (it keeps a heartbeat key in redis).
+After each scrape, the newest earthquakes are summarized by the ai (SUMMARY_PIPELINE config), so requests never wait on the model.
+"""
+
+logger = logging.getLogger(__name__)
+
+# redis key of the lock that allows only one scrape per interval
+LOCK_KEY = "phivolcs-ingestion-lock"
+
+# redis lock held while a scrape runs, so a scrape slower than the interval is not started twice (the lock of this cache key)
+# released when the scrape ends, it only expires if its worker died mid-scrape
+RUNNING_LOCK_KEY = "phivolcs-ingestion-running"
+RUNNING_LOCK_TTL = 15 * 60 # seconds
+
+# redis key of the heartbeat of a dedicated ingest process (expires two intervals after it stops)
+WORKER_KEY = "phivolcs-ingestion-worker"
+
+# set the interval between scrapes of the phivolcs feed
+POLL_INTERVAL = 60 # seconds
+
+# number of the newest earthquakes the summary pipeline looks at after each scrape
+SUMMARY_LOOKAHEAD = 50
+
+
+# scrape phivolcs if no other worker is scraping, or has scraped during the current interval
+# returns the new snapshot, or None if another worker holds the interval
+def ingest_once(interval=POLL_INTERVAL):
+    # identify this worker in the lock, for debugging
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+
+    # hold the running lock for the whole scrape, so a scrape slower than the interval never runs twice at once
+    running_lock = Cache(RUNNING_LOCK_KEY)
+    running_token = running_lock.acquire_lock(RUNNING_LOCK_TTL)
+    if running_token is None:
+        return None
+
+    try:
+        # take the interval key only if it does not exist yet (nx), and let it expire after one interval (ex)
+        # the key is never released, so the next scrape can only happen once the interval passed
+        if not redis_client.set(LOCK_KEY, owner, nx=True, ex=interval):
+            return None
+
+        try:
+            snapshot = refresh_snapshot()
+        except Exception:
+            # release the interval so the next poll retries the failed scrape
+            redis_client.delete(LOCK_KEY)
+            raise
+
+        # summarize the newest earthquakes right away, so requests never wait on the model
+        if snapshot and current_app.config.get("SUMMARY_PIPELINE"):
+            try:
+                summarize_earthquakes(snapshot["data"][:SUMMARY_LOOKAHEAD])
+            except Exception as e:
+                logger.warning("summary pipeline failed: %s", e)
+
+        return snapshot
+    finally:
+        running_lock.release_lock(running_token)
+
+
+# poll forever (or until stop_event is set)
+# dedicated: this is the `ingest` process, which keeps the heartbeat; otherwise (a thread of an app process)
+# stand by while a dedicated process is running
+def run_ingestion(interval=POLL_INTERVAL, stop_event=None, dedicated=False):
+    stop_event = stop_event or threading.Event()
+    owner = f"{socket.gethostname()}-{os.getpid()}"
+
+    # parse the locations of a catalog ingested before the gazetteer existed, here rather than in a request
+    try:
+        add_missing_places()
+    except Exception as e:
+        logger.warning("adding missing places failed: %s", e)
+    finally:
+        db.session.remove()
+
+    while not stop_event.is_set():
+        try:
+            if dedicated:
+                redis_client.set(WORKER_KEY, owner, ex=interval * 2)
+            if dedicated or not redis_client.exists(WORKER_KEY):
+                ingest_once(interval)
+        except Exception as e:
+            # keep serving the last good snapshot, and try again on the next poll
+            logger.warning("ingestion failed: %s", e)
+        finally:
+            # the loop keeps one app context for its whole life: end the session after every poll,
+            # so a failed flush (e.g. "database is locked" during a backfill) is rolled back instead of
+            # failing every later poll with PendingRollbackError
+            db.session.remove()
+
+        # wake up a few times per interval so a released lock is picked up quickly
+        stop_event.wait(max(1, interval // 4))
+
+
+# start the polling loop as a daemon thread of the app process
+def start_ingestion_thread(app, interval=POLL_INTERVAL):
+    # the worker writes to the catalog, so it runs inside the app context
+    def target():
+        with app.app_context():
+            run_ingestion(interval)
+
+    thread = threading.Thread(target=target, name="phivolcs-ingestion", daemon=True)
+    thread.start()
+    return thread
+
+
+# start the polling thread with the first request served by this process
+# (a cli command or the parent process of the reloader never serves one, so never starts it)
+def start_ingestion_on_first_request(app, interval=POLL_INTERVAL):
+    started = []
+    lock = threading.Lock()
+
+    @app.before_request
+    def start_ingestion():
+        if started:
+            return
+        with lock:
+            if not started:
+                started.append(start_ingestion_thread(app, interval))
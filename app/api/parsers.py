@@ -0,0 +1,241 @@
+import importlib.util
+import os
+import re
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
+from .client import BASE_URL
+from ..records import EarthquakeRecord
+
+"""
+Parser backends for the PHIVOLCS main page.
+Every backend yields the same earthquake records (records.py) in the same (newest-first) order:
+1. bs4 - the BeautifulSoup extractor on the pure-python html.parser (always available)
+2. lxml - a streaming pull parser that only keeps the data table rows in memory (needs lxml)
+
+Both follow the same rules, so broken markup gives the same rows:
+- a data row is a tr whose nearest table is a MsoNormalTable, except the first row (header) of that table,
+  so the rows of nested tables are read once
+- its cells are the td whose nearest tr is that row (html.parser nests unclosed rows, lxml closes them),
+  and the text of a cell leaves out the text of the cells nested in it
+- rows come in document order
+
+The backend is picked with the PHIVOLCS_PARSER environment variable, otherwise bs4 is used.
+lxml is faster on large pages, but its parity is only checked on the fixture pages and edge cases of
+benchmarks/bench_parser.py; check it on a captured PHIVOLCS page before making it the default.
+"""
+
+# size of the chunks fed to the streaming parser
+CHUNK_SIZE = 64 * 1024
+
+
+# build the earthquake record from the texts of the 6 cells and the href of the date-time cell
+# returns None for a row that cannot be parsed (e.g. a missing magnitude)
+def build_earthquake(texts, href):
+    # if href variable has content, normalize and combine to base url
+    detail_link = None
+    if href:
+        # replace the \ with /
+        normalized_path = href.replace('\\','/')
+
+        # combine the base url and normalized path to make a url
+        try:
+            detail_link = urljoin(BASE_URL, normalized_path)
+        except Exception:
+            detail_link = normalized_path
+
+    # remove the whitespaces of all cell texts
+    date_time, latitude, longitude, depth, magnitude, location = (text.strip() for text in texts)
+
+    return EarthquakeRecord.from_texts(date_time, detail_link, latitude, longitude, depth, magnitude, location)
+
+
+# data rows of the page with beautiful soup: trs whose nearest table is a MsoNormalTable, except its first tr
+# walks the tree with a stack, not recursion: html.parser nests unclosed rows, which can go thousands deep
+def bs4_rows(soup):
+    # rows seen per MsoNormalTable (by id), to skip the header row of each table
+    row_counts = {}
+
+    stack = [(soup, None)]
+    while stack:
+        element, table = stack.pop()
+        if element.name == 'table':
+            table = element
+        elif element.name == 'tr' and table is not None and 'MsoNormalTable' in table.get('class', []):
+            # the first tr is usually header, so skip
+            row_counts[id(table)] = row_counts.get(id(table), 0) + 1
+            if row_counts[id(table)] > 1:
+                yield element
+
+        # children in reverse, so they are popped in document order
+        stack.extend((child, table) for child in reversed(element.contents) if isinstance(child, Tag))
+
+
+# cells of a row with beautiful soup: the tds whose nearest tr is the row
+def bs4_cells(row):
+    cells = []
+    stack = list(reversed(row.contents))
+    while stack:
+        element = stack.pop()
+        if not isinstance(element, Tag) or element.name == 'tr':
+            continue
+        if element.name == 'td':
+            cells.append(element)
+        stack.extend(reversed(element.contents))
+    return cells
+
+
+# text of a cell with beautiful soup, without the text of the cells nested in it (unclosed tds)
+def bs4_text(cell):
+    parts = []
+    stack = list(reversed(cell.contents))
+    while stack:
+        element = stack.pop()
+        if isinstance(element, Tag):
+            if element.name not in ('td', 'tr'):
+                stack.extend(reversed(element.contents))
+        elif type(element) in (NavigableString, CData):
+            parts.append(str(element))
+    return "".join(parts)
+
+
+# text of a cell with lxml, without the text of the cells nested in it
+def lxml_text(cell):
+    parts = [cell.text or ""]
+    for child in cell:
+        # skip comments, and cells or rows nested in the cell
+        if isinstance(child.tag, str) and child.tag not in ("td", "tr"):
+            parts.append(lxml_text(child))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
+def iter_earthquakes_bs4(html):
+    # parse the text data into a data structure using beautiful soup
+    soup = BeautifulSoup(html, 'html.parser')
+
+    for row in bs4_rows(soup):
+        # find all data values stored in td
+        cells = bs4_cells(row)
+
+        # skip rows that are strictly not 6 cells (not an earthquake row)
+        if len(cells) != 6:
+            continue
+
+        # the date-time text is the text of the a tag, which links to the bulletin
+        # (the text of the cell if there is no link)
+        a_tag = cells[0].find('a')
+        texts = [bs4_text(cells[0] if a_tag is None else a_tag)] + [bs4_text(cell) for cell in cells[1:]]
+        href = a_tag.get('href') if a_tag is not None else None
+
+        earthquake = build_earthquake(texts, href)
+        if earthquake is not None:
+            yield earthquake
+
+
+def iter_earthquakes_lxml(html):
+    # imported here so the bs4 backend works without lxml installed
+    from lxml import etree
+
+    # only ask for table and tr events; the parser still reads the whole page, but in C
+    parser = etree.HTMLPullParser(events=("start", "end"), tag=("table", "tr"))
+
+    # rows seen per MsoNormalTable, to skip the header row of each table
+    row_counts = {}
+    # position (document order) of the open rows, and whether they are data rows
+    open_rows = {}
+    # earthquakes of the rows inside the current top-level row, sent in document order once it ends
+    pending = []
+    position = 0
+
+    for start in range(0, len(html), CHUNK_SIZE):
+        parser.feed(html[start:start + CHUNK_SIZE])
+
+        for event, element in parser.read_events():
+            if element.tag == "table":
+                if event == "end" and element in row_counts:
+                    del row_counts[element]
+                continue
+
+            if event == "start":
+                # only rows that belong to a MsoNormalTable (their nearest table), the first one being the header
+                table = next(element.iterancestors("table"), None)
+                is_data = False
+                if table is not None and "MsoNormalTable" in (table.get("class") or "").split():
+                    row_counts[table] = row_counts.get(table, 0) + 1
+                    is_data = row_counts[table] > 1
+
+                open_rows[element] = (position, is_data)
+                position += 1
+                continue
+
+            row_position, is_data = open_rows.pop(element)
+
+            # the cells of this row only, not the ones of rows nested in it
+            cells = [cell for cell in element.iter("td") if next(cell.iterancestors("tr"), None) is element]
+            if is_data and len(cells) == 6:
+                # the date-time text is the text of the a tag, which links to the bulletin
+                # (the text of the cell if there is no link)
+                a_tag = cells[0].find(".//a")
+                texts = [lxml_text(cells[0] if a_tag is None else a_tag)] + [lxml_text(cell) for cell in cells[1:]]
+                href = a_tag.get("href") if a_tag is not None else None
+
+                earthquake = build_earthquake(texts, href)
+                if earthquake is not None:
+                    pending.append((row_position, earthquake))
+
+            # a top-level row is done: send its earthquakes (a row ends after the rows nested in it,
+            # so sort them back into document order) and free it
+            if next(element.iterancestors("tr"), None) is None:
+                pending.sort(key=lambda item: item[0])
+                for _, earthquake in pending:
+                    yield earthquake
+                pending.clear()
+                element.clear()
+
+
+# available backends by name
+BACKENDS = {
+    "bs4": iter_earthquakes_bs4,
+    "lxml": iter_earthquakes_lxml,
+}
+
+
+# pick the backend: the environment variable (e.g. PHIVOLCS_PARSER=lxml), else bs4
+def default_backend():
+    name = os.getenv("PHIVOLCS_PARSER", "bs4")
+
+    # lxml is optional: fall back to bs4 if it is asked for but not installed
+    if name == "lxml" and importlib.util.find_spec("lxml") is None:
+        return "bs4"
+    return name
+
+
+PARSER = default_backend()
+
+
+# yield the earthquakes of the phivolcs main page (newest first), using the given or default backend
+def iter_earthquakes(html, backend=None):
+    return BACKENDS[backend or PARSER](html)
+
+
+# start of a table row, to cut the page between two rows
+ROW_START = re.compile(r"<tr[\s>]", re.IGNORECASE)
+
+
+# the page up to the end of the first row linking to detail_link (the rows newer than it, and itself),
+# or None if the page has no such link; the backends read a cut page the same way (missing closing tags)
+# so an incremental parse only builds the tree of the new rows, even with the bs4 backend
+def page_until(html, detail_link):
+    # the page links to bulletins relative to the base url, with backslashes (see build_earthquake)
+    hrefs = [detail_link]
+    if detail_link.startswith(BASE_URL):
+        path = detail_link[len(BASE_URL):]
+        hrefs += [path.replace('/', '\\'), path]
+
+    positions = [position for position in (html.find(href) for href in hrefs) if position >= 0]
+    if not positions:
+        return None
+
+    # cut at the start of the next row
+    next_row = ROW_START.search(html, min(positions))
+    return html[:next_row.start()] if next_row else html
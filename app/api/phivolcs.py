@@ -1,146 +1,325 @@
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import jsonify
-from urllib.parse import urljoin
-import requests
+from urllib.parse import urlparse
+import hashlib
+import json
+import logging
 import re
-from datetime import datetime
+import requests
+import threading
+from datetime import datetime, timedelta
+from .caching import redis_client
+from .client import BASE_URL, fetch, save_validators
+from .events import publish_earthquakes
+from .parsers import iter_earthquakes, page_until
+from ..catalog import (load_bulletin_failures, load_bulletins, query_earthquakes, save_bulletin_failures,
+                       save_bulletins, upsert_earthquakes)
+from ..clustering import get_cluster_engine
+from ..metrics import count_cache, timed
+from ..records import EarthquakeRecord, dumps
+from ..services import build_geojson
+
+logger = logging.getLogger(__name__)
+
+# redis key of the snapshot published by the ingestion worker
+# requests only ever read this key, they never scrape phivolcs themselves
+# the keys end with the format of the snapshot (v2: typed numbers), so a new format starts from a fresh scrape
+SNAPSHOT_KEY = "phivolcs-snapshot:v2"
+SNAPSHOT_VERSION_KEY = "phivolcs-snapshot-version:v2"
+GEOJSON_KEY = "phivolcs-geojson:v2"
+GEOJSON_VERSION_KEY = "phivolcs-geojson-version:v2"
+LATEST_KEY = "phivolcs-latest:v2"
+
+# the geojson feed has the earthquakes of the catalog of the last GEOJSON_DAYS days (at most GEOJSON_LIMIT)
+GEOJSON_DAYS = 30
+GEOJSON_LIMIT = 20000
+
+# maximum number of earthquakes kept in the snapshot
+CATALOG_LIMIT = 1000
+
+# maximum number of bulletins fetched per refresh (the rest are fetched on the next refreshes)
+ENRICH_LIMIT = 200
+
+# a failed bulletin is fetched again after BULLETIN_RETRY_DELAY, doubled after every failure (up to
+# BULLETIN_MAX_DELAY), and given up after BULLETIN_MAX_ATTEMPTS failures, or at once if it does not exist (404, 410)
+BULLETIN_RETRY_DELAY = timedelta(minutes=5)
+BULLETIN_MAX_DELAY = timedelta(hours=6)
+BULLETIN_MAX_ATTEMPTS = 5
+MISSING_STATUSES = (404, 410)
+
+# maximum number of concurrent bulletin fetches, in total and per host
+BULLETIN_WORKERS = 8
+PER_HOST_LIMIT = 4
+
+# thread pool for the bulletin fetches, and the concurrency limit per host
+bulletin_pool = ThreadPoolExecutor(max_workers=BULLETIN_WORKERS, thread_name_prefix="bulletin")
+host_limits = {}
+host_limits_lock = threading.Lock()
+
+# records of the last snapshot published or read by this worker, and its version
+published_version = None
+published_records = None
+
+# parse the phivolcs main page into a list of earthquakes (newest first)
+# the parser backend is picked in parsers.py (bs4 or the faster lxml)
+@timed("parse")
+def parse_earthquakes(html):
+    return list(iter_earthquakes(html))
+
+
+# parse only the earthquakes newer than last_link (the newest detail link already ingested)
+# returns the new earthquakes (newest first), and whether last_link was found on the page
+@timed("parse")
+def parse_new_earthquakes(html, last_link):
+    # the feed is newest-first: only parse the page up to the row of last_link, with any backend
+    # (the whole page is parsed if that row is not where the page links to it, e.g. a link outside the table)
+    head = page_until(html, last_link) if last_link else None
+    if head is not None:
+        new_earthquakes, found = scan_new_earthquakes(head, last_link)
+        if found:
+            return new_earthquakes, True
+
+    return scan_new_earthquakes(html, last_link)
+
+
+# the earthquakes of the page before last_link, and whether last_link was found
+def scan_new_earthquakes(html, last_link):
+    new_earthquakes = []
+
+    # stop at the first row that was already ingested (the streaming lxml backend stops reading the page there too)
+    for earthquake in iter_earthquakes(html):
+        if earthquake.detail_link == last_link:
+            return new_earthquakes, True
+        new_earthquakes.append(earthquake)
+
+    return new_earthquakes, False
+
+
+# scrape phivolcs once, store the new earthquakes in the catalog, and publish the result as the shared snapshot
+# this is only called by the ingestion worker (see ingestion.py), never by a request
+# needs an app context for the database
+def refresh_snapshot():
+    global published_version, published_records
+
+    now = datetime.now()
+
+    # fetch the main page; revalidate against the last fetch only if a snapshot was already published
+    previous = read_snapshot_records()
+    result = fetch(BASE_URL, conditional=previous is not None)
+
+    # the feed did not change (304 or same body hash)
+    if not result.changed:
+        # keep the published snapshot as is, unless some bulletins still have to be fetched
+        count_cache("snapshot", True)
+        if not pending_enrichment(previous):
+            save_validators(result)
+            return read_snapshot()
+        earthquakes = previous
+        announced = []
+
+    else:
+        # newest detail link already in the snapshot
+        last_link = previous[0].detail_link if previous else None
+
+        new_earthquakes, found = parse_new_earthquakes(result.text, last_link)
+
+        # nothing new on the page (e.g. only the page layout changed), keep the published snapshot
+        # note: revisions of already ingested rows are not picked up by the incremental parse
+        if found and not new_earthquakes and not pending_enrichment(previous):
+            save_validators(result)
+            return read_snapshot()
+
+        # store the new earthquakes in the persistent catalog
+        with timed("catalog_upsert"):
+            upsert_earthquakes(new_earthquakes)
+
+        if found:
+            # prepend only the new earthquakes to the stored ones
+            earthquakes = (new_earthquakes + previous)[:CATALOG_LIMIT]
+            announced = new_earthquakes
+        else:
+            # the last known earthquake is no longer on the page (or this is the first scrape),
+            # so the whole page was parsed and replaces the snapshot
+            earthquakes = new_earthquakes[:CATALOG_LIMIT]
+
+            # only announce the earthquakes that were not in the previous snapshot (nothing on the first scrape)
+            announced = []
+            if previous is not None:
+                known = {earthquake.detail_link for earthquake in previous}
+                announced = [earthquake for earthquake in new_earthquakes if earthquake.detail_link not in known]
+
+    # add the bulletin details (reported intensities, expected damage and aftershocks) to the earthquakes
+    with timed("enrichment"):
+        earthquakes = enrich_earthquakes(earthquakes)
+
+    # add the context of their earthquake sequence (main shock, foreshocks and aftershocks, decay)
+    with timed("clustering"):
+        engine = get_cluster_engine()
+        earthquakes = [earthquake.with_cluster(engine.context_of(earthquake.detail_link)) for earthquake in earthquakes]
+
+    # the feed is newest-first, so the first row is the latest earthquake
+    latest = earthquakes[0].to_dict() if earthquakes else None
+
+    snapshot = {
+        "data": [earthquake.to_dict() for earthquake in earthquakes],
+        "latest": latest,
+        "last_updated": now.isoformat(timespec="seconds"),
+    }
+
+    # store the snapshot without expiry so the last good scrape is always served
+    # along with its version (a hash of its content), used by clients to revalidate (etags)
+    # and the geojson feed of the recent catalog for the map, built once here instead of per request
+    data = dumps(snapshot)
+    version = hashlib.sha256(data).hexdigest()[:16]
+
+    with timed("redis_set"):
+        redis_client.mset({
+            SNAPSHOT_KEY: data,
+            SNAPSHOT_VERSION_KEY: version,
+            **build_recent_geojson(now),
+            # the latest earthquake on its own, so the dashboard does not load the whole snapshot
+            LATEST_KEY: dumps({"latest": latest, "last_updated": snapshot["last_updated"]}),
+        })
 
-# initialize storage for cached data, last fetched time
-cached_data_all = None
-last_fetch_time_all = None
+    # keep the records, so the next refresh does not parse the published json again
+    published_version, published_records = version, earthquakes
 
-# separate cache and fetch time for latest earthquake
-cached_data_latest = None
-last_fetch_time_latest = None
+    # only now that the page is published, the next fetch may be answered with "not modified"
+    save_validators(result)
 
-# set constant cache duration
-CACHE_DURATION = 10 * 60 # seconds
+    # push the new earthquakes (with their bulletin details) to the connected dashboards
+    # the snapshot is already published, so a dashboard reloading on the message sees them
+    announced_links = {earthquake.detail_link for earthquake in announced}
+    try:
+        publish_earthquakes(
+            [earthquake.to_dict() for earthquake in earthquakes if earthquake.detail_link in announced_links],
+            snapshot["last_updated"],
+        )
+    except Exception as e:
+        logger.warning("publishing new earthquakes failed: %s", e)
 
-# set the base url for api calls
-BASE_URL = 'https://earthquake.phivolcs.dost.gov.ph/'
+    return snapshot
 
-def get_latest_earthquake():
-    global cached_data_latest, last_fetch_time_latest
 
+# records of the published snapshot (None if nothing was published yet)
+# the worker that published it still has them in memory, the others parse the published json once
+def read_snapshot_records():
+    global published_version, published_records
+
+    version = read_snapshot_version()
+    if version is None:
+        return None
+
+    count_cache("published_records", version == published_version)
+    if version != published_version:
+        snapshot = read_snapshot()
+        if snapshot is None:
+            return None
+
+        records = [EarthquakeRecord.from_dict(earthquake) for earthquake in snapshot["data"]]
+        published_version, published_records = version, [record for record in records if record is not None]
+
+    return published_records
+
+
+# read the snapshot published by the ingestion worker (None if nothing was published yet)
+def read_snapshot():
+    with timed("redis_get"):
+        data = redis_client.get(SNAPSHOT_KEY)
+
+    if data is None:
+        return None
+
+    return json.loads(data)
+
+
+# read the version of the published snapshot (None if nothing was published yet)
+# this is much smaller than the snapshot itself, so requests can revalidate without loading the data
+def read_snapshot_version():
+    with timed("redis_get"):
+        version = redis_client.get(SNAPSHOT_VERSION_KEY)
+
+    if version is None:
+        return None
+
+    return version.decode("utf-8")
+
+
+# the geojson feed of the recent catalog and its version (a hash of its content), as redis keys and values
+# needs an app context for the database
+def build_recent_geojson(now=None):
+    now = now or datetime.now()
+    with timed("geojson"):
+        geojson = build_geojson(query_earthquakes(since=now - timedelta(days=GEOJSON_DAYS), limit=GEOJSON_LIMIT))
+
+    return {GEOJSON_KEY: geojson, GEOJSON_VERSION_KEY: hashlib.sha256(geojson).hexdigest()[:16]}
+
+
+# publish the geojson feed again, after the catalog was written outside of a snapshot refresh (backfill)
+# needs an app context for the database
+def publish_geojson():
+    feed = build_recent_geojson()
+    with timed("redis_set"):
+        redis_client.mset(feed)
+
+
+# read the gzipped geojson feed published by the ingestion worker, along with its version
+# both are read in one command, so they always match (None, None if nothing was published yet)
+def read_geojson():
+    with timed("redis_get"):
+        version, data = redis_client.mget(GEOJSON_VERSION_KEY, GEOJSON_KEY)
+
+    if version is None or data is None:
+        return None, None
+
+    return version.decode("utf-8"), data
+
+
+# read the latest earthquake published by the ingestion worker, as {"latest", "last_updated"} (None if nothing was published yet)
+def read_latest():
+    with timed("redis_get"):
+        data = redis_client.get(LATEST_KEY)
+
+    if data is None:
+        return None
+
+    return json.loads(data)
+
+
+# find an earthquake of the snapshot by its detail link (None if not in the snapshot)
+def find_earthquake(detail_link):
+    # most lookups are for the latest earthquake, which does not need the whole snapshot
+    latest = read_latest()
+    found = bool(latest and latest["latest"] and latest["latest"]["detail_link"] == detail_link)
+    count_cache("latest", found)
+    if found:
+        return latest["latest"]
+
+    snapshot = read_snapshot() or {"data": []}
+    return next((earthquake for earthquake in snapshot["data"] if earthquake["detail_link"] == detail_link), None)
+
+
+def get_latest_earthquake():
     try:
-        now = datetime.now()
+        snapshot = read_latest()
 
-        # check if cache for latest earthquake exists
-        if cached_data_latest and last_fetch_time_latest and (now.second - last_fetch_time_latest.second) < CACHE_DURATION:
-            # if cache exists, return cached data
+        # the worker has not published anything yet
+        if snapshot is None or snapshot["latest"] is None:
             return jsonify({
-                "success": True,
-                "data": cached_data_latest,
-                "cached": True,
-                "last_updated": last_fetch_time_latest
+                "success": False,
+                "message": "Error fetching latest earthquake data",
+                "error": "Earthquake data has not been ingested yet"
             })
-        
-        # same headers
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Connection': "keep-alive",
-        }
-
-        # request http connection with the phivolcs website, refuse ssl connection, timeout after 10 seconds of no connection
-        res = requests.get(BASE_URL, headers=headers, verify=False, timeout=10)
-        # use bs4 to parse the response (text form) into html structure
-        soup = BeautifulSoup(res.text, "html.parser")
-
-        # select all elements in the html that have css selector of MsoNormalTable
-        tables = soup.select('table.MsoNormalTable')
-
-        # iterate through tables
-        for table in tables:
-            print(table)
-            print("before row")
-            try:
-                # only get second row (first row is header)
-                # one row only since we're getting latest earthquake
-                row = table.select('tr')[1]
-            except:
-                continue
-            print(f"after row: {row}")
-
-            # get all the table data elements of the row
-            # the contents of the td's are the data for the earthquakes
-            cells = row.find_all('td')
-
-            # continue to next table if cells is empty
-            if not cells:
-                continue
-        
-            # continue to next table if # of cells is strictly not 6
-            if len(cells) != 6:
-                continue
-        
-            # store the cell data 
-            date_time_cell = cells[0]
-            latitude_cell = cells[1]
-            longitude_cell = cells[2]
-            depth_cell = cells[3]
-            magnitude_cell = cells[4]
-            location_cell = cells[5]
-
-            # find a tag to get href
-            date_time = date_time_cell.find('a').get_text().strip()
-            a_tag = date_time_cell.find('a')
-            # check if a tag and href exists
-            if a_tag and 'href' in a_tag.attrs:
-                # get the href value
-                href = a_tag['href']
-            else:
-                href = None
-            
-            # if href variable has content, normalize and combine to base url
-            if href:
-                # replace the \ with /
-                normalized_path = href.replace('\\','/')
-                
-                # combine the base url and normalized path to make a url
-                try:
-                    detail_link = urljoin(BASE_URL, normalized_path)
-                except Exception:
-                    detail_link = normalized_path
-
-            # get_earthquake_additional_info(detail_link)
-
-            # format the rest of the data to string, and remove whitespaces
-            latitude = latitude_cell.get_text().strip()
-            longitude = longitude_cell.get_text().strip()
-            depth = depth_cell.get_text().strip()
-            magnitude= magnitude_cell.get_text().strip()
-            location = location_cell.get_text().strip()
-
-            additional_info = get_earthquake_additional_info(detail_link)
-            
-            # append all data as dictionary, to earthquake list
-            earthquake ={
-                "date_time": date_time,
-                "detail_link": detail_link,
-                "latitude": latitude,
-                "longitude": longitude,
-                "depth": depth,
-                "magnitude": magnitude,
-                "location": location,
-            }
-
-            earthquake.update(additional_info)
-        
-        # update cached_data_all to recently fetched data
-        cached_data_latest = earthquake
-        # update last fetched time to current time
-        last_fetch_time_latest = now
 
         # return json of status indicators, along with data
         return jsonify({
             "success": True,
-            "data": earthquake,
-            "cached": False,
-            "last_updated": last_fetch_time_latest
+            "data": snapshot["latest"],
+            "cached": True,
+            "last_updated": snapshot["last_updated"]
         })
-    
+
     # catch an error
     except Exception as e:
         # return json with status indicator, along with error message for debugging
@@ -151,130 +330,26 @@ def get_latest_earthquake():
         })
 
 
-
-
-
 def get_all_earthquakes():
-    # get global variables for cached_data_all and last fetched time
-    global cached_data_all, last_fetch_time_all
-
     try:
-        # get current time
-        now = datetime.now()
-        print(f"time {now}")
-
-        # check if cached_data_all and last_fetch_time_all has content
-        # check if time elapsed between current time and last fetched time is less than cache duration
-        if cached_data_all and last_fetch_time_all and (now.second - last_fetch_time_all.second) < CACHE_DURATION:
-            # if true, return cached data with last updated time
+        snapshot = read_snapshot()
+
+        # the worker has not published anything yet
+        if snapshot is None:
             return jsonify({
-                "success": True,
-                "data": cached_data_all,
-                "cached": True,
-                "last_updated": last_fetch_time_all
+                "success": False,
+                "message": "Error fetching earthquake data",
+                "error": "Earthquake data has not been ingested yet"
             })
 
-        print(f"condition done")
-
-        # apply headers (same from original server.js)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Connection': "keep-alive",
-        }
-
-        # fetch the text data from the phivolcs earthquake database
-        # set verify to false to bypass SSL
-        # apply headers
-        res = requests.get("https://earthquake.phivolcs.dost.gov.ph/", headers=headers, verify=False, timeout=10)
-        print("requests done")
-
-        # parse the text data into a data structure using beautiful soup
-        soup = BeautifulSoup(res.text, 'html.parser')
-        print("parsing done")
-        
-        # create list of tables with css MsoNormalTable
-        tables = soup.select('table.MsoNormalTable')
-
-        # initialize list of earthquakes
-        earthquakes = []
-
-        # iterate through tables
-        for table in tables:
-            
-            # select tr values and iterate through them
-            # the first tr is usually header, so skip
-            for row in table.select('tr')[1:]:
-                # find all data values stored in td
-
-                cells = row.find_all('td')
-                if not cells:
-                    continue
-
-                if len(cells) == 6:
-
-                    date_time_cell = cells[0]
-                    latitude_cell = cells[1]
-                    longitude_cell = cells[2]
-                    depth_cell = cells[3]
-                    magnitude_cell = cells[4]
-                    location_cell = cells[5]
-
-                    # find a tag to get href
-                    date_time = date_time_cell.find('a').get_text().strip()
-                    a_tag = date_time_cell.find('a')
-                    # check if a tag and href exists
-                    if a_tag and 'href' in a_tag.attrs:
-                        # get the href value
-                        href = a_tag['href']
-                    else:
-                        href = None
-                    
-                    # if href variable has content, normalize and combine to base url
-                    if href:
-                        # replace the \ with /
-                        normalized_path = href.replace('\\','/')
-                        
-                        # combine the base url and normalized path to make a url
-                        try:
-                            detail_link = urljoin(BASE_URL, normalized_path)
-                        except Exception:
-                            detail_link = normalized_path
-
-                    # get_earthquake_additional_info(detail_link)
-
-                    # format the rest of the data to string, and remove whitespaces
-                    latitude = latitude_cell.get_text().strip()
-                    longitude = longitude_cell.get_text().strip()
-                    depth = depth_cell.get_text().strip()
-                    magnitude= magnitude_cell.get_text().strip()
-                    location = location_cell.get_text().strip()
-
-                    # append all data as dictionary, to earthquake list
-                    earthquakes.append({
-                        "date_time": date_time,
-                        "detail_link": detail_link,
-                        "latitude": latitude,
-                        "longitude": longitude,
-                        "depth": depth,
-                        "magnitude": magnitude,
-                        "location": location,
-                    })
-
-        # update cached_data_all to recently fetched data
-        cached_data_all = earthquakes
-        # update last fetched time to current time
-        last_fetch_time_all = now
-
         # return json of status indicators, along with data
         return jsonify({
             "success": True,
-            "data": earthquakes,
-            "cached": False,
-            "last_updated": last_fetch_time_all
+            "data": snapshot["data"],
+            "cached": True,
+            "last_updated": snapshot["last_updated"]
         })
-    
+
     # catch an error
     except Exception as e:
         # return json with status indicator, along with error message for debugging
@@ -299,15 +374,14 @@ complete for viewing each earthquake
 
 
 def get_earthquake_additional_info(detail_link):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Connection': "keep-alive",
-    }
+    # bulletins never change once published, so there is nothing to revalidate
+    res = fetch(detail_link, conditional=False)
+    return parse_bulletin(res.text)
+
 
-    res = requests.get(detail_link, headers=headers, verify=False, timeout=10)
-    soup = BeautifulSoup(res.text, 'html.parser')
+# extract the additional details from the html of a bulletin
+def parse_bulletin(html):
+    soup = BeautifulSoup(html, 'html.parser')
 
     paragraphs = soup.find_all("p")
 
@@ -339,6 +413,97 @@ def get_earthquake_additional_info(detail_link):
     })
 
 
+# earthquakes of the list that have a bulletin, but not its details yet
+# bulletins that failed are only pending again once their retry time has passed, and never once given up,
+# so a bulletin that keeps failing does not force a refresh of an unchanged feed
+# needs an app context for the database
+def pending_enrichment(earthquakes, now=None):
+    now = now or datetime.now()
+
+    pending = [earthquake for earthquake in earthquakes if earthquake.detail_link and not earthquake.enriched]
+    failures = load_bulletin_failures({earthquake.detail_link for earthquake in pending})
+
+    return [
+        earthquake for earthquake in pending
+        if earthquake.detail_link not in failures or retry_due(failures[earthquake.detail_link], now)
+    ]
+
+
+# whether a failed bulletin may be fetched again
+def retry_due(failure, now):
+    return failure.retry_after is not None and failure.retry_after <= now
+
+
+# attempts, error and retry time of a bulletin that failed once more (no retry time: given up)
+def next_failure(failure, error, now):
+    attempts = (failure.attempts if failure else 0) + 1
+
+    status = error.response.status_code if isinstance(error, requests.HTTPError) and error.response is not None else None
+    if status in MISSING_STATUSES or attempts >= BULLETIN_MAX_ATTEMPTS:
+        return attempts, str(error), None
+
+    delay = min(BULLETIN_RETRY_DELAY * 2 ** (attempts - 1), BULLETIN_MAX_DELAY)
+    return attempts, str(error), now + delay
+
+
+# fetch a bulletin, allowing only a few concurrent requests to the same host
+def fetch_bulletin(detail_link):
+    host = urlparse(detail_link).netloc
+
+    with host_limits_lock:
+        if host not in host_limits:
+            host_limits[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        limit = host_limits[host]
+
+    with limit:
+        return get_earthquake_additional_info(detail_link)
+
+
+# add the bulletin details to the earthquakes that do not have them yet (newest first, up to ENRICH_LIMIT per call)
+# stored bulletins are read from the database, the rest are fetched concurrently and stored permanently
+# needs an app context for the database
+def enrich_earthquakes(earthquakes):
+    now = datetime.now()
+
+    pending = pending_enrichment(earthquakes, now)[:ENRICH_LIMIT]
+    links = {earthquake.detail_link for earthquake in pending}
+
+    # bulletins never change once published, so stored details are reused as is
+    bulletins = load_bulletins(links)
+    count_cache("bulletin", True, len(bulletins))
+    count_cache("bulletin", False, len(links) - len(bulletins))
+
+    # fetch the missing bulletins on the thread pool (only http happens in the threads, no database)
+    futures = {bulletin_pool.submit(fetch_bulletin, link): link for link in links if link not in bulletins}
+    fetched = {}
+    errors = {}
+    for future in as_completed(futures):
+        try:
+            fetched[futures[future]] = future.result()
+        except Exception as e:
+            errors[futures[future]] = e
+
+    # count the failures: the earthquake stays pending until its retry time, or for good once given up
+    failures = load_bulletin_failures(errors)
+    retries = {}
+    for link, error in errors.items():
+        retries[link] = next_failure(failures.get(link), error, now)
+        if retries[link][2] is None:
+            logger.warning("bulletin fetch failed for %s, giving up after %d attempts: %s", link, retries[link][0], error)
+        else:
+            logger.warning("bulletin fetch failed for %s (attempt %d): %s", link, retries[link][0], error)
+
+    save_bulletins(fetched)
+    save_bulletin_failures(retries)
+    bulletins.update(fetched)
+
+    # return new records, with the details added where available
+    return [
+        earthquake.with_bulletin(bulletins[earthquake.detail_link]) if earthquake.detail_link in bulletins else earthquake
+        for earthquake in earthquakes
+    ]
+
+
 def get_info_text(tag) -> str:
     parent = tag.find_parent("td")
     parent_sibling = parent.find_next_sibling("td")
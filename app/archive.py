@@ -0,0 +1,210 @@
+import csv
+import json
+import os
+from datetime import datetime
+import numpy as np
+from .records import DATE_TIME_FORMAT, parse_location
+
+"""
+Columnar, memory-mapped store for the historical PHIVOLCS catalogs (the monthly csv files).
+Each column is one .npy file, loaded with mmap_mode="r", so opening years of history only maps the files:
+1. times - datetime64[m], sorted oldest first
+2. latitudes, longitudes, depths, magnitudes - float32
+3. locations, provinces - int32 codes into the string lists of dictionaries.json (dictionary encoding)
+
+Aggregations group with numpy (sort + reduceat), without building python objects per row.
+"""
+
+# default folder of the store (repository root / archive), can be changed with the ARCHIVE_DIR environment variable
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "../archive"))
+
+# numeric columns and their types
+COLUMNS = {
+    "times": "datetime64[m]",
+    "latitudes": np.float32,
+    "longitudes": np.float32,
+    "depths": np.float32,
+    "magnitudes": np.float32,
+    "locations": np.int32,
+    "provinces": np.int32,
+}
+
+# the province is the name in parentheses at the end of the location, e.g. "... of City Of Bogo (Cebu)"
+def parse_province(location):
+    return parse_location(location)["province"] or ""
+
+
+# group magnitudes by key: returns the sorted unique keys, the count and max magnitude per key
+def group_stats(keys, magnitudes):
+    if len(keys) == 0:
+        return keys[:0], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    # sort by key so every group is contiguous, then reduce each group
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    magnitudes = magnitudes[order]
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    maxes = np.maximum.reduceat(magnitudes, starts)
+
+    return keys[starts], counts, maxes
+
+
+class Archive:
+    # open the store of the given folder (memory-mapped, nothing is read until used)
+    def __init__(self, directory=ARCHIVE_DIR, columns=None, dictionaries=None):
+        if columns is None:
+            columns = {
+                name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                for name in COLUMNS
+            }
+            with open(os.path.join(directory, "dictionaries.json"), encoding="utf-8") as f:
+                dictionaries = json.load(f)
+
+        self.columns = columns
+        self.dictionaries = dictionaries
+
+    def __len__(self):
+        return len(self.columns["times"])
+
+    def __getattr__(self, name):
+        # columns are available as attributes, e.g. archive.magnitudes
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    # archive of the events between start and end (datetimes, end excluded), without copying
+    def between(self, start=None, end=None):
+        first = 0 if start is None else np.searchsorted(self.times, np.datetime64(start, "m"), side="left")
+        last = len(self) if end is None else np.searchsorted(self.times, np.datetime64(end, "m"), side="left")
+
+        return Archive(columns={name: column[first:last] for name, column in self.columns.items()}, dictionaries=self.dictionaries)
+
+    # count and max magnitude per day
+    def per_day(self):
+        days, counts, maxes = group_stats(self.times.astype("datetime64[D]"), self.magnitudes)
+
+        return [
+            {"day": str(day), "count": int(count), "max_magnitude": round(float(maximum), 1)}
+            for day, count, maximum in zip(days, counts, maxes)
+        ]
+
+    # count and max magnitude per province
+    def per_province(self):
+        codes, counts, maxes = group_stats(self.provinces, self.magnitudes)
+        names = self.dictionaries["provinces"]
+
+        return [
+            {"province": names[code], "count": int(count), "max_magnitude": round(float(maximum), 1)}
+            for code, count, maximum in zip(codes, counts, maxes)
+        ]
+
+    # count and max magnitude per magnitude bin (e.g. 2.0-3.0 for width 1.0)
+    def per_magnitude_bin(self, width=1.0):
+        bins, counts, maxes = group_stats(np.floor(self.magnitudes / width).astype(np.int32), self.magnitudes)
+
+        return [
+            {"from_magnitude": round(float(b * width), 1), "to_magnitude": round(float((b + 1) * width), 1),
+             "count": int(count), "max_magnitude": round(float(maximum), 1)}
+            for b, count, maximum in zip(bins, counts, maxes)
+        ]
+
+
+# read a phivolcs csv (date-time, latitude, longitude, depth, magnitude, location) into columns
+def read_csv(path, locations, provinces):
+    # dictionary encoding: the code of a string is its position in the list
+    location_codes = {name: code for code, name in enumerate(locations)}
+    province_codes = {name: code for code, name in enumerate(provinces)}
+
+    def encode(codes, names, name):
+        if name not in codes:
+            codes[name] = len(names)
+            names.append(name)
+        return codes[name]
+
+    rows = {name: [] for name in COLUMNS}
+
+    with open(path, encoding="utf-8") as f:
+        reader = csv.reader(f)
+        # skip the header
+        next(reader, None)
+
+        for row in reader:
+            if len(row) != 6:
+                continue
+
+            try:
+                time = datetime.strptime(row[0].strip(), DATE_TIME_FORMAT)
+                values = [float(value) for value in row[1:5]]
+            except ValueError:
+                continue
+
+            location = row[5].strip()
+            rows["times"].append(time)
+            rows["latitudes"].append(values[0])
+            rows["longitudes"].append(values[1])
+            rows["depths"].append(values[2])
+            rows["magnitudes"].append(values[3])
+            rows["locations"].append(encode(location_codes, locations, location))
+            rows["provinces"].append(encode(province_codes, provinces, parse_province(location)))
+
+    return {name: np.array(values, dtype=COLUMNS[name]) for name, values in rows.items()}
+
+
+# add the events of csv files to the store (creating it if needed); returns the number of events in the store
+def load_csv(paths, directory=ARCHIVE_DIR):
+    os.makedirs(directory, exist_ok=True)
+
+    # start from the existing store, if any
+    if os.path.exists(os.path.join(directory, "dictionaries.json")):
+        existing = Archive(directory)
+        dictionaries = existing.dictionaries
+        parts = [{name: np.asarray(column) for name, column in existing.columns.items()}]
+    else:
+        dictionaries = {"locations": [], "provinces": []}
+        parts = []
+
+    for path in paths:
+        parts.append(read_csv(path, dictionaries["locations"], dictionaries["provinces"]))
+
+    columns = {name: np.concatenate([part[name] for part in parts]) if parts else np.array([], dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    # drop events loaded twice (same time, place, depth and magnitude), and sort oldest first
+    keys = np.stack([columns["times"].astype(np.int64).astype(np.float64)] + [columns[name].astype(np.float64) for name in COLUMNS if name not in ("times", "provinces")], axis=1)
+    _, unique = np.unique(keys, axis=0, return_index=True)
+    order = unique[np.argsort(columns["times"][unique], kind="stable")]
+
+    # write every column to a temporary file first, so open memory maps of the old files stay valid
+    for name in COLUMNS:
+        np.save(os.path.join(directory, f"{name}.tmp.npy"), columns[name][order])
+    for name in COLUMNS:
+        os.replace(os.path.join(directory, f"{name}.tmp.npy"), os.path.join(directory, f"{name}.npy"))
+
+    with open(os.path.join(directory, "dictionaries.json"), "w", encoding="utf-8") as f:
+        json.dump(dictionaries, f)
+
+    return len(order)
+
+
+# store opened by this process, reopened when the loader rewrote it
+opened_archive = None
+opened_version = None
+
+
+# get the store of ARCHIVE_DIR (None if nothing was loaded yet)
+def get_archive():
+    global opened_archive, opened_version
+
+    path = os.path.join(ARCHIVE_DIR, "dictionaries.json")
+    if not os.path.exists(path):
+        return None
+
+    # the loader rewrites dictionaries.json last, so its modification time tells if the store changed
+    version = os.path.getmtime(path)
+    if opened_archive is None or version != opened_version:
+        opened_archive = Archive(ARCHIVE_DIR)
+        opened_version = version
+
+    return opened_archive
@@ -0,0 +1,271 @@
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import Bulletin, BulletinFailure, CatalogVersion, Earthquake, Place, Summary, db
+from .records import DATE_TIME_FORMAT, parse_location
+
+"""
+Persistent earthquake catalog (the Earthquake table in models.py).
+The ingestion worker upserts every scraped earthquake here, so the history survives restarts
+and is shared by all workers, unlike the snapshot which only holds the recent feed.
+"""
+
+# number of rows per insert statement (sqlite allows a limited number of parameters per statement)
+BATCH_SIZE = 500
+
+# insert statements that support "on conflict" upserts, per database dialect
+INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+# convert an earthquake record (records.py, already parsed when scraped) or a stored Earthquake to column values
+def to_row(earthquake):
+    return {
+        "detail_link": earthquake.detail_link,
+        "date_time": earthquake.date_time,
+        "latitude": earthquake.latitude,
+        "longitude": earthquake.longitude,
+        "depth": earthquake.depth,
+        "magnitude": earthquake.magnitude,
+        "location": earthquake.location,
+    }
+
+
+# column values of the stored earthquakes with the given detail links, as {detail_link: row}
+def load_rows(detail_links):
+    rows = {}
+    detail_links = list(detail_links)
+
+    for start in range(0, len(detail_links), BATCH_SIZE):
+        batch = detail_links[start:start + BATCH_SIZE]
+        for earthquake in Earthquake.query.filter(Earthquake.detail_link.in_(batch)):
+            rows[earthquake.detail_link] = to_row(earthquake)
+
+    return rows
+
+
+# insert new earthquakes (records) and update known ones (matched by detail link) in bulk
+# known earthquakes with the same values are not written again
+# returns the number of rows written
+def upsert_earthquakes(earthquakes):
+    # a bulletin can only be written once per statement, so keep the first (newest) row per detail link
+    unique_rows = {}
+    for row in map(to_row, earthquakes):
+        if row["detail_link"]:
+            unique_rows.setdefault(row["detail_link"], row)
+
+    # only the new earthquakes and the ones revised by phivolcs
+    stored = load_rows(unique_rows)
+    rows = [row for detail_link, row in unique_rows.items() if stored.get(detail_link) != row]
+    if not rows:
+        return 0
+    changed = any(row["detail_link"] in stored for row in rows)
+
+    insert = INSERTS[db.engine.dialect.name]
+
+    for start in range(0, len(rows), BATCH_SIZE):
+        statement = insert(Earthquake).values(rows[start:start + BATCH_SIZE])
+        # a known bulletin may have been revised by phivolcs, so update its values
+        statement = statement.on_conflict_do_update(
+            index_elements=[Earthquake.detail_link],
+            set_={column: statement.excluded[column] for column in rows[0] if column != "detail_link"},
+        )
+        db.session.execute(statement)
+
+    # parse the new locations once, for the area index (gazetteer.py)
+    save_places(row["location"] for row in rows)
+
+    bump_catalog_version(changed)
+    db.session.commit()
+    return len(rows)
+
+
+# increment the catalog version, in the transaction of the write (the caller commits)
+# changed: known earthquakes were updated, so indexes cannot just append the new rows
+# a single update statement, so concurrent writers (worker and backfill) never lose a bump
+def bump_catalog_version(changed=False):
+    insert = INSERTS[db.engine.dialect.name]
+    db.session.execute(
+        insert(CatalogVersion).values(id=1, version=0, changed_version=0)
+        .on_conflict_do_nothing(index_elements=[CatalogVersion.id])
+    )
+
+    values = {"version": CatalogVersion.version + 1}
+    if changed:
+        values["changed_version"] = CatalogVersion.version + 1
+    db.session.execute(update(CatalogVersion).where(CatalogVersion.id == 1).values(**values))
+
+
+# version of the catalog and version of its last change of known earthquakes, as (version, changed_version)
+# the version changes whenever earthquakes are inserted or updated ((0, 0) before the first write)
+def read_catalog_versions():
+    versions = db.session.query(CatalogVersion.version, CatalogVersion.changed_version).filter(CatalogVersion.id == 1).first()
+    return tuple(versions) if versions else (0, 0)
+
+
+def read_catalog_version():
+    return read_catalog_versions()[0]
+
+
+# add locations to the gazetteer (Place table), parsed with records.parse_location; known ones are skipped
+# the caller commits
+def save_places(locations):
+    rows = [{"location": location, **parse_location(location)} for location in set(locations)]
+    insert = INSERTS[db.engine.dialect.name]
+
+    for start in range(0, len(rows), BATCH_SIZE):
+        statement = insert(Place).values(rows[start:start + BATCH_SIZE])
+        db.session.execute(statement.on_conflict_do_nothing(index_elements=[Place.location]))
+
+
+# load the stored bulletin details of the given detail links, as {detail_link: details}
+def load_bulletins(detail_links):
+    bulletins = {}
+    detail_links = list(detail_links)
+
+    for start in range(0, len(detail_links), BATCH_SIZE):
+        batch = detail_links[start:start + BATCH_SIZE]
+        for bulletin in Bulletin.query.filter(Bulletin.detail_link.in_(batch)):
+            bulletins[bulletin.detail_link] = {
+                "reported_intensities": bulletin.reported_intensities,
+                "expected_damage": bulletin.expected_damage,
+                "expected_aftershocks": bulletin.expected_aftershocks,
+            }
+
+    return bulletins
+
+
+# store fetched bulletin details, given as {detail_link: details}
+def save_bulletins(bulletins):
+    for detail_link, details in bulletins.items():
+        db.session.merge(Bulletin(detail_link=detail_link, **details))
+
+    # a bulletin fetched at last is no longer a failure
+    detail_links = list(bulletins)
+    for start in range(0, len(detail_links), BATCH_SIZE):
+        batch = detail_links[start:start + BATCH_SIZE]
+        BulletinFailure.query.filter(BulletinFailure.detail_link.in_(batch)).delete(synchronize_session=False)
+
+    db.session.commit()
+
+
+# load the failed bulletin fetches of the given detail links, as {detail_link: BulletinFailure}
+def load_bulletin_failures(detail_links):
+    failures = {}
+    detail_links = list(detail_links)
+
+    for start in range(0, len(detail_links), BATCH_SIZE):
+        batch = detail_links[start:start + BATCH_SIZE]
+        for failure in BulletinFailure.query.filter(BulletinFailure.detail_link.in_(batch)):
+            failures[failure.detail_link] = failure
+
+    return failures
+
+
+# store failed bulletin fetches, given as {detail_link: (attempts, error, retry_after)}
+# retry_after is None for a bulletin given up
+def save_bulletin_failures(failures):
+    for detail_link, (attempts, error, retry_after) in failures.items():
+        db.session.merge(BulletinFailure(detail_link=detail_link, attempts=attempts, error=error, retry_after=retry_after))
+
+    db.session.commit()
+
+
+# load a stored ai summary by its key (None if not generated yet)
+def load_summary(key):
+    summary = db.session.get(Summary, key)
+    return summary.text if summary else None
+
+
+# keys of the given summary keys that are already stored
+def stored_summary_keys(keys):
+    keys = list(keys)
+    stored = set()
+
+    for start in range(0, len(keys), BATCH_SIZE):
+        batch = keys[start:start + BATCH_SIZE]
+        stored.update(key for (key,) in db.session.query(Summary.key).filter(Summary.key.in_(batch)))
+
+    return stored
+
+
+# store an ai summary
+def save_summary(key, detail_link, prompt_version, text):
+    db.session.merge(Summary(key=key, detail_link=detail_link, prompt_version=prompt_version, text=text))
+    db.session.commit()
+
+
+# earthquakes of the catalog with their bulletin details (only the ones whose bulletin was fetched), newest first
+def query_enriched_earthquakes(min_magnitude=None, limit=None):
+    query = db.session.query(Earthquake, Bulletin).join(Bulletin, Bulletin.detail_link == Earthquake.detail_link)
+
+    if min_magnitude is not None:
+        query = query.filter(Earthquake.magnitude >= min_magnitude)
+
+    query = query.order_by(Earthquake.date_time.desc())
+    if limit is not None:
+        query = query.limit(limit)
+
+    for earthquake, bulletin in query:
+        yield {
+            **to_dict(earthquake),
+            "reported_intensities": bulletin.reported_intensities,
+            "expected_damage": bulletin.expected_damage,
+            "expected_aftershocks": bulletin.expected_aftershocks,
+        }
+
+
+# convert an Earthquake row to a json-ready dict (date-time in the same format as the feed)
+def to_dict(earthquake):
+    return {
+        "id": earthquake.id,
+        "date_time": earthquake.date_time.strftime(DATE_TIME_FORMAT),
+        "detail_link": earthquake.detail_link,
+        "latitude": earthquake.latitude,
+        "longitude": earthquake.longitude,
+        "depth": earthquake.depth,
+        "magnitude": earthquake.magnitude,
+        "location": earthquake.location,
+    }
+
+
+# load the earthquakes with the given ids, in the same order as the ids
+def get_earthquakes(ids):
+    ids = [int(id) for id in ids]
+    earthquakes = {}
+
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        for earthquake in Earthquake.query.filter(Earthquake.id.in_(batch)):
+            earthquakes[earthquake.id] = earthquake
+
+    return [earthquakes[id] for id in ids if id in earthquakes]
+
+
+# query the catalog, newest first, with keyset pagination
+# after is the (date_time, id) of the last earthquake of the previous page
+# bbox is (min_lat, min_lon, max_lat, max_lon)
+def query_earthquakes(since=None, until=None, min_magnitude=None, bbox=None, after=None, limit=100):
+    query = Earthquake.query
+
+    if since is not None:
+        query = query.filter(Earthquake.date_time >= since)
+    if until is not None:
+        query = query.filter(Earthquake.date_time < until)
+    if min_magnitude is not None:
+        query = query.filter(Earthquake.magnitude >= min_magnitude)
+    if bbox is not None:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        query = query.filter(
+            Earthquake.latitude.between(min_lat, max_lat),
+            Earthquake.longitude.between(min_lon, max_lon),
+        )
+    if after is not None:
+        after_date_time, after_id = after
+        query = query.filter(db.or_(
+            Earthquake.date_time < after_date_time,
+            db.and_(Earthquake.date_time == after_date_time, Earthquake.id < after_id),
+        ))
+
+    return query.order_by(Earthquake.date_time.desc(), Earthquake.id.desc()).limit(limit).all()
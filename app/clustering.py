@@ -0,0 +1,300 @@
+import threading
+import time
+import numpy as np
+from datetime import timedelta
+from sqlalchemy import func
+from .catalog import read_catalog_versions
+from .records import DATE_TIME_FORMAT
+from .metrics import count_cache
+from .models import Earthquake, db
+from .spatial import SpatialIndex, haversine_km
+
+"""
+Space-time clustering of the catalog into earthquake sequences (main shock, foreshocks, aftershocks),
+with the window method of Gardner and Knopoff (1974):
+an earthquake of magnitude M claims every earthquake within distance_window_km(M) and time_window_days(M) of it.
+
+1. build: the earthquakes of at least MIN_MAINSHOCK_MAGNITUDE are visited from the largest down;
+   each one that is not claimed yet claims the unclaimed earthquakes of its window (found with the spatial grid,
+   then filtered with vectorized numpy), which makes a cluster if it claims at least one
+2. add: new earthquakes (newer than all the others) join the cluster whose window they fall in,
+   become its main shock if larger, or start a new cluster with the unclaimed earthquakes before them
+3. context: size, foreshocks, aftershocks, largest aftershock, and the Omori decay exponent p of the aftershocks
+   (the aftershock rate falls as 1 / t^p), for the dashboard and the ai summaries
+
+Only the last HORIZON_DAYS of the catalog are clustered (counted back from its newest earthquake).
+"""
+
+# only earthquakes of at least this magnitude start a cluster (smaller ones can still join one)
+MIN_MAINSHOCK_MAGNITUDE = 3.5
+
+# number of days of the catalog that are clustered
+HORIZON_DAYS = 365
+
+# minimum number of aftershocks to estimate the decay exponent
+MIN_DECAY_AFTERSHOCKS = 10
+
+# rebuild from scratch at least this often, so old earthquakes leave the horizon
+REBUILD_INTERVAL = 24 * 60 * 60 # seconds
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+# gardner-knopoff distance window of magnitudes, in km
+def distance_window_km(magnitudes):
+    return 10 ** (0.1238 * np.asarray(magnitudes, dtype=np.float64) + 0.983)
+
+
+# gardner-knopoff time window of magnitudes, in days
+def time_window_days(magnitudes):
+    magnitudes = np.asarray(magnitudes, dtype=np.float64)
+    return np.where(magnitudes >= 6.5, 10 ** (0.032 * magnitudes + 2.7389), 10 ** (0.5409 * magnitudes - 0.547))
+
+
+# omori decay exponent p of aftershock delays (days after the main shock), None if too few aftershocks
+def omori_exponent(delays):
+    delays = np.asarray(delays, dtype=np.float64)
+    delays = delays[delays > 0]
+    if len(delays) < MIN_DECAY_AFTERSHOCKS:
+        return None
+
+    # aftershock rate in logarithmic time bins; the slope of log rate against log time is -p
+    edges = np.logspace(np.log10(delays.min()), np.log10(delays.max()), num=8)
+    if edges[-1] <= edges[0]:
+        return None
+    counts, edges = np.histogram(delays, bins=edges)
+    rates = counts / np.diff(edges)
+    centers = np.sqrt(edges[:-1] * edges[1:])
+
+    used = counts > 0
+    if used.sum() < 3:
+        return None
+
+    slope, _ = np.polyfit(np.log10(centers[used]), np.log10(rates[used]), 1)
+    return round(float(-slope), 2)
+
+
+class ClusterEngine:
+    # build the clusters of earthquakes given as parallel columns, oldest first
+    # times are datetime64[s] (or datetimes), the other columns are numbers and strings
+    def __init__(self, ids, detail_links, times, latitudes, longitudes, magnitudes, locations):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.detail_links = list(detail_links)
+        self.seconds = np.asarray(times, dtype="datetime64[s]").astype(np.int64)
+        self.days = self.seconds / SECONDS_PER_DAY
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.magnitudes = np.asarray(magnitudes, dtype=np.float64)
+        self.locations = list(locations)
+
+        # cluster number of every earthquake (-1: not in a cluster), and the main shock position of every cluster
+        self.labels = np.full(len(self.ids), -1, dtype=np.int64)
+        self.mainshocks = np.empty(0, dtype=np.int64)
+
+        # position of every detail link (the newest one wins for duplicates)
+        self.positions = {link: position for position, link in enumerate(self.detail_links)}
+        self.contexts = {}
+
+        # the ingestion worker adds earthquakes while requests read the clusters (reentrant: largest_clusters reads contexts)
+        self.lock = threading.RLock()
+
+        self.build()
+
+    def __len__(self):
+        return len(self.ids)
+
+    # positions of the unclaimed earthquakes in the window of the earthquake at position, among candidates
+    def window_members(self, position, candidates):
+        magnitude = self.magnitudes[position]
+        window_km = distance_window_km(magnitude)
+        window_days = time_window_days(magnitude)
+
+        candidates = candidates[self.labels[candidates] == -1]
+        candidates = candidates[np.abs(self.days[candidates] - self.days[position]) <= window_days]
+        distances = haversine_km(self.latitudes[position], self.longitudes[position],
+                                 self.latitudes[candidates], self.longitudes[candidates])
+        return candidates[distances <= window_km]
+
+    # start a cluster with its main shock and members (positions); returns its number
+    def add_cluster(self, mainshock, members):
+        cluster = len(self.mainshocks)
+        self.labels[members] = cluster
+        self.labels[mainshock] = cluster
+        self.mainshocks = np.append(self.mainshocks, mainshock)
+        return cluster
+
+    # cluster the whole catalog, largest earthquakes first
+    def build(self):
+        # the grid index gives the earthquakes near a point, its ids are the positions in the arrays
+        index = SpatialIndex(np.arange(len(self.ids)), self.latitudes, self.longitudes)
+
+        candidates = np.flatnonzero(self.magnitudes >= MIN_MAINSHOCK_MAGNITUDE)
+        for position in candidates[np.argsort(-self.magnitudes[candidates], kind="stable")]:
+            if self.labels[position] != -1:
+                continue
+
+            nearby, _ = index.within_radius(self.latitudes[position], self.longitudes[position],
+                                            float(distance_window_km(self.magnitudes[position])))
+            members = self.window_members(position, nearby)
+            if len(members) > 1:
+                self.add_cluster(position, members)
+
+    # add new earthquakes, newer than all the known ones (same columns as the constructor, oldest first)
+    def add(self, ids, detail_links, times, latitudes, longitudes, magnitudes, locations):
+        with self.lock:
+            start = len(self.ids)
+
+            seconds = np.asarray(times, dtype="datetime64[s]").astype(np.int64)
+            self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+            self.seconds = np.concatenate([self.seconds, seconds])
+            self.days = self.seconds / SECONDS_PER_DAY
+            self.latitudes = np.concatenate([self.latitudes, np.asarray(latitudes, dtype=np.float64)])
+            self.longitudes = np.concatenate([self.longitudes, np.asarray(longitudes, dtype=np.float64)])
+            self.magnitudes = np.concatenate([self.magnitudes, np.asarray(magnitudes, dtype=np.float64)])
+            self.labels = np.concatenate([self.labels, np.full(len(seconds), -1, dtype=np.int64)])
+            self.detail_links.extend(detail_links)
+            self.locations.extend(locations)
+
+            for position in range(start, len(self.ids)):
+                self.positions[self.detail_links[position]] = position
+                self.assign(position)
+
+            self.contexts.clear()
+
+    # place a new earthquake: join the cluster whose window covers it, or start a new one
+    def assign(self, position):
+        mainshocks = self.mainshocks
+        magnitudes = self.magnitudes[mainshocks]
+
+        # clusters whose main shock window covers the new earthquake
+        covering = (self.days[position] - self.days[mainshocks] <= time_window_days(magnitudes)) & (
+            haversine_km(self.latitudes[position], self.longitudes[position],
+                         self.latitudes[mainshocks], self.longitudes[mainshocks]) <= distance_window_km(magnitudes)
+        )
+
+        if covering.any():
+            # join the cluster of the largest main shock
+            cluster = int(np.flatnonzero(covering)[np.argmax(magnitudes[covering])])
+            self.labels[position] = cluster
+            # a larger earthquake becomes the main shock (the earlier ones are now its foreshocks)
+            if self.magnitudes[position] > magnitudes[cluster]:
+                self.mainshocks[cluster] = position
+            return
+
+        if self.magnitudes[position] < MIN_MAINSHOCK_MAGNITUDE:
+            return
+
+        # the earthquakes are sorted by time, so the time window is a slice
+        first = np.searchsorted(self.days, self.days[position] - time_window_days(self.magnitudes[position]), side="left")
+        members = self.window_members(position, np.arange(first, position + 1))
+        if len(members) > 1:
+            self.add_cluster(position, members)
+
+    # context of the cluster of an earthquake (by detail link), None if it is not in a cluster
+    def context_of(self, detail_link):
+        with self.lock:
+            position = self.positions.get(detail_link)
+            if position is None or self.labels[position] == -1:
+                return None
+
+            cluster = int(self.labels[position])
+            if cluster not in self.contexts:
+                self.contexts[cluster] = self.cluster_context(cluster)
+
+            context = dict(self.contexts[cluster])
+            mainshock = self.mainshocks[cluster]
+            if position == mainshock:
+                context["role"] = "mainshock"
+            else:
+                context["role"] = "foreshock" if self.seconds[position] < self.seconds[mainshock] else "aftershock"
+            return context
+
+    def cluster_context(self, cluster):
+        mainshock = self.mainshocks[cluster]
+        members = np.flatnonzero(self.labels == cluster)
+        delays = self.days[members] - self.days[mainshock]
+        aftershocks = members[delays > 0]
+
+        return {
+            "mainshock": {
+                "detail_link": self.detail_links[mainshock],
+                "date_time": self.date_time(mainshock),
+                "magnitude": float(self.magnitudes[mainshock]),
+                "location": self.locations[mainshock],
+            },
+            "events": int(len(members)),
+            "foreshocks": int((delays < 0).sum()),
+            "aftershocks": int(len(aftershocks)),
+            "largest_aftershock": float(self.magnitudes[aftershocks].max()) if len(aftershocks) else None,
+            "decay_rate": omori_exponent(delays),
+            "last_event": self.date_time(members[-1]),
+        }
+
+    # the largest clusters (most earthquakes first), as contexts of their main shock
+    def largest_clusters(self, limit=20, min_events=2):
+        with self.lock:
+            if len(self.mainshocks) == 0:
+                return []
+
+            sizes = np.bincount(self.labels[self.labels >= 0], minlength=len(self.mainshocks))
+            clusters = [int(cluster) for cluster in np.argsort(-sizes, kind="stable") if sizes[cluster] >= min_events]
+            return [self.context_of(self.detail_links[self.mainshocks[cluster]]) for cluster in clusters[:limit]]
+
+    def date_time(self, position):
+        return self.seconds[position].astype("datetime64[s]").item().strftime(DATE_TIME_FORMAT)
+
+
+# engine of the catalog, updated as new earthquakes are ingested
+catalog_engine = None
+catalog_version = None
+built_at = 0
+engine_lock = threading.Lock()
+
+
+# columns of catalog rows, for the engine
+def to_columns(rows):
+    if not rows:
+        return [], [], [], [], [], [], []
+    return [list(column) for column in zip(*rows)]
+
+
+# get the cluster engine of the catalog (needs an app context)
+# new earthquakes are added incrementally; anything else (e.g. a backfill of older months) rebuilds it
+def get_cluster_engine():
+    global catalog_engine, catalog_version, built_at
+
+    # every write to the catalog bumps its version; changed_version tells if known earthquakes were revised
+    version, changed_version = read_catalog_versions()
+    columns = (Earthquake.id, Earthquake.detail_link, Earthquake.date_time, Earthquake.latitude,
+               Earthquake.longitude, Earthquake.magnitude, Earthquake.location)
+
+    with engine_lock:
+        count_cache("cluster_engine", catalog_engine is not None and version == catalog_version)
+        if catalog_engine is not None and version == catalog_version:
+            return catalog_engine
+
+        # no known earthquake was revised since the engine was built: only new rows to look at
+        if catalog_engine is not None and changed_version <= catalog_version and \
+                time.monotonic() - built_at < REBUILD_INTERVAL:
+            rows = (db.session.query(*columns).filter(Earthquake.id > int(catalog_engine.ids.max(initial=0)))
+                    .order_by(Earthquake.date_time, Earthquake.id).all())
+            newest = catalog_engine.seconds.max(initial=0)
+
+            # only newer earthquakes were appended: add them
+            if len(catalog_engine) and \
+                    all(np.datetime64(row.date_time, "s").astype(np.int64) >= newest for row in rows):
+                catalog_engine.add(*to_columns(rows))
+                catalog_version = version
+                return catalog_engine
+
+        # build from scratch, over the horizon counted back from the newest earthquake
+        newest = db.session.query(func.max(Earthquake.date_time)).scalar()
+        query = db.session.query(*columns)
+        if newest is not None:
+            query = query.filter(Earthquake.date_time >= newest - timedelta(days=HORIZON_DAYS))
+        rows = query.order_by(Earthquake.date_time, Earthquake.id).all()
+
+        catalog_engine = ClusterEngine(*to_columns(rows))
+        catalog_version = version
+        built_at = time.monotonic()
+        return catalog_engine
@@ -0,0 +1,113 @@
+import click
+from datetime import date, datetime
+from flask import current_app
+from flask.cli import with_appcontext
+from .api.backfill import CHECKPOINT_PATH, CONCURRENCY, backfill
+from .api.client import BASE_URL
+from .api.ingestion import run_ingestion
+from .archive import ARCHIVE_DIR, load_csv
+from .catalog import load_summary, query_enriched_earthquakes, save_summary
+from .clustering import get_cluster_engine
+from .gazetteer import add_missing_places
+from .api.googleai import PROMPT_VERSION, generate_summary, summary_key
+
+
+# command for running the ingestion worker as its own process
+# usage: flask --app run ingest
+@click.command("ingest")
+@click.option("--interval", type=int, default=None, help="Seconds between scrapes of the PHIVOLCS feed")
+@with_appcontext
+def ingest_command(interval):
+    interval = interval or current_app.config["INGESTION_INTERVAL"]
+    click.echo(f"Polling PHIVOLCS every {interval} seconds")
+    run_ingestion(interval, dedicated=True)
+
+
+# command for loading historical csv catalogs into the columnar archive
+# usage: flask --app run load-archive app/api/phivolcs/data/phivolcs_earthquake_data_10_2025.csv
+@click.command("load-archive")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--directory", default=ARCHIVE_DIR, help="Folder of the archive")
+def load_archive_command(paths, directory):
+    count = load_csv(paths, directory)
+    click.echo(f"Archive has {count} earthquakes")
+
+
+# command for generating the ai summaries of the catalog ahead of time (skips the ones already stored)
+# usage: flask --app run warm-summaries --min-magnitude 4 --limit 100
+@click.command("warm-summaries")
+@click.option("--min-magnitude", type=float, default=None, help="Only summarize earthquakes of at least this magnitude")
+@click.option("--limit", type=int, default=None, help="Only summarize this many of the newest earthquakes")
+@with_appcontext
+def warm_summaries_command(min_magnitude, limit):
+    generated = 0
+    failed = 0
+    engine = get_cluster_engine()
+
+    for earthquake in query_enriched_earthquakes(min_magnitude, limit):
+        # same sequence context as the published snapshot, so the keys match
+        cluster = engine.context_of(earthquake["detail_link"])
+        if cluster is not None:
+            earthquake["cluster"] = cluster
+
+        key = summary_key(earthquake)
+        if load_summary(key) is not None:
+            continue
+
+        data = generate_summary(earthquake)
+        if data["success"]:
+            save_summary(key, earthquake["detail_link"], PROMPT_VERSION, data["data"])
+            generated += 1
+        else:
+            click.echo(f"Failed to summarize {earthquake['detail_link']}: {data['error']}")
+            failed += 1
+
+    click.echo(f"Generated {generated} summaries ({failed} failed) for prompt version {PROMPT_VERSION}")
+
+
+# command for adding the locations of the catalog that are missing from the gazetteer (area index)
+# e.g. after upgrading a catalog ingested before the gazetteer existed (the ingestion worker also does it on start)
+# usage: flask --app run add-places
+@click.command("add-places")
+@with_appcontext
+def add_places_command():
+    click.echo(f"Added {add_missing_places()} places to the gazetteer")
+
+
+# parse a YYYY-MM option into a (year, month) pair
+def parse_month(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        parsed = datetime.strptime(value, "%Y-%m")
+    except ValueError:
+        raise click.BadParameter("expected a month as YYYY-MM")
+    return parsed.year, parsed.month
+
+
+# command for backfilling the catalog from the phivolcs monthly archive pages and bulletins
+# an interrupted backfill resumes from its checkpoint file
+# usage: flask --app run backfill --start 2024-01 --end 2024-12
+@click.command("backfill")
+@click.option("--start", required=True, callback=parse_month, help="First month to backfill, as YYYY-MM")
+@click.option("--end", default=None, callback=parse_month, help="Last month to backfill, as YYYY-MM (default: this month)")
+@click.option("--base-url", default=BASE_URL, help="Server to crawl, e.g. a local stand-in of PHIVOLCS")
+@click.option("--concurrency", type=int, default=CONCURRENCY, help="Maximum number of requests at a time")
+@click.option("--checkpoint", default=CHECKPOINT_PATH, help="File of the months already backfilled")
+@click.option("--skip-bulletins", is_flag=True, help="Only backfill the earthquakes, not their bulletin details")
+@with_appcontext
+def backfill_command(start, end, base_url, concurrency, checkpoint, skip_bulletins):
+    end = end or (date.today().year, date.today().month)
+
+    def report(key, stats):
+        if stats is None:
+            click.echo(f"{key}: already backfilled")
+        elif "error" in stats:
+            click.echo(f"{key}: failed ({stats['error']})")
+        elif not stats["found"]:
+            click.echo(f"{key}: no archive page")
+        else:
+            click.echo(f"{key}: {stats['earthquakes']} earthquakes, {stats['bulletins']} bulletins ({stats['failed']} failed, {stats['missing']} missing)")
+
+    completed = backfill(start, end, base_url, concurrency, checkpoint, not skip_bulletins, report)
+    click.echo(f"Backfilled {len(completed)} months")
@@ -0,0 +1,171 @@
+import threading
+import numpy as np
+from .catalog import bump_catalog_version, read_catalog_version, save_places
+from .metrics import count_cache
+from .models import Earthquake, Place, db
+
+"""
+Gazetteer of the PHIVOLCS location strings, and an inverted index of the catalog by area.
+A location such as "015  km S 22° W of City Of Bogo (Cebu)" is parsed once (records.parse_location),
+when it is first ingested, into the Place table (models.py): distance 15 km, bearing "S 22° W" (azimuth 202°),
+municipality "City Of Bogo", province "Cebu".
+Highly urbanized cities have no province in parentheses ("020  km N 79° W of City Of Davao").
+
+The area index maps every province and municipality to the positions of its earthquakes (postings),
+over the catalog sorted oldest first, so "all earthquakes in Cebu this week" is a dictionary lookup
+and two binary searches instead of a regex over every row.
+"""
+
+# posting of an unknown area
+EMPTY = np.zeros(0, dtype=np.int64)
+
+# key of an area name: case and spacing do not matter ("City of Bogo" is "City Of Bogo")
+def normalize(name):
+    return " ".join(name.split()).casefold() if name else ""
+
+
+# group positions by key (None: not indexed): returns {key: positions}, positions stay in their order
+def build_postings(keys):
+    codes_of = {}
+    codes = np.empty(len(keys), dtype=np.int64)
+    for position, key in enumerate(keys):
+        codes[position] = -1 if key is None else codes_of.setdefault(key, len(codes_of))
+
+    # sort by code so every posting is contiguous (stable, so the positions stay sorted)
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    if len(order) == 0:
+        return {}
+
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    keys_by_code = list(codes_of)
+
+    return {keys_by_code[sorted_codes[start]]: posting for start, posting in zip(starts, np.split(order, starts[1:]))}
+
+
+class AreaIndex:
+    # build the index from parallel sequences of ids, times, magnitudes, municipalities and provinces, oldest first
+    def __init__(self, ids, times, magnitudes, municipalities, provinces):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.times = np.asarray(times, dtype="datetime64[s]")
+        self.magnitudes = np.asarray(magnitudes, dtype=np.float64)
+
+        # display name of every key (the first spelling seen)
+        self.names = {}
+        province_keys = []
+        municipality_keys = []
+        for municipality, province in zip(municipalities, provinces):
+            province_key = normalize(province) or None
+            municipality_key = (normalize(municipality), normalize(province)) if municipality else None
+            if province_key is not None:
+                self.names.setdefault(province_key, province)
+            if municipality_key is not None:
+                self.names.setdefault(municipality_key, (municipality, province))
+            province_keys.append(province_key)
+            municipality_keys.append(municipality_key)
+
+        self.provinces = build_postings(province_keys)
+        self.municipalities = build_postings(municipality_keys)
+
+        # a municipality name can exist in several provinces (e.g. San Jose)
+        self.municipality_keys = {}
+        for key in self.municipalities:
+            self.municipality_keys.setdefault(key[0], []).append(key)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # positions of the earthquakes of a province and/or municipality, from since (included) to until (excluded),
+    # oldest first
+    def positions(self, province=None, municipality=None, since=None, until=None):
+        if municipality:
+            keys = [key for key in self.municipality_keys.get(normalize(municipality), [])
+                    if province is None or key[1] == normalize(province)]
+            positions = np.sort(np.concatenate([self.municipalities[key] for key in keys])) if keys else EMPTY
+        elif province:
+            positions = self.provinces.get(normalize(province), EMPTY)
+        else:
+            raise ValueError("expected a province or a municipality")
+
+        return self.between(positions, since, until)
+
+    # slice sorted positions to a time range: the catalog is sorted by time, so its positions are too
+    def between(self, positions, since=None, until=None):
+        first = 0 if since is None else np.searchsorted(self.times, np.datetime64(since, "s"), side="left")
+        last = len(self) if until is None else np.searchsorted(self.times, np.datetime64(until, "s"), side="left")
+
+        return positions[np.searchsorted(positions, first):np.searchsorted(positions, last)]
+
+    # ids of the earthquakes of an area, newest first
+    def query(self, province=None, municipality=None, since=None, until=None):
+        return self.ids[self.positions(province, municipality, since, until)[::-1]]
+
+    # count, max magnitude and latest earthquake per province or municipality (level), most earthquakes first
+    def counts(self, level="province", since=None, until=None):
+        postings = {"province": self.provinces, "municipality": self.municipalities}[level]
+
+        areas = []
+        for key, posting in postings.items():
+            positions = self.between(posting, since, until)
+            if len(positions) == 0:
+                continue
+
+            if level == "province":
+                area = {"province": self.names[key]}
+            else:
+                municipality, province = self.names[key]
+                area = {"municipality": municipality, "province": province}
+
+            area.update({
+                "count": int(len(positions)),
+                "max_magnitude": round(float(self.magnitudes[positions].max()), 1),
+                "latest": str(self.times[positions[-1]]),
+            })
+            areas.append(area)
+
+        areas.sort(key=lambda area: -area["count"])
+        return areas
+
+
+# index of the catalog, rebuilt when the catalog changes
+catalog_index = None
+catalog_version = None
+catalog_lock = threading.Lock()
+
+
+# add the locations of the catalog that are not in the gazetteer yet (e.g. catalogs ingested before it existed)
+# run by the ingestion worker when it starts and by `flask --app run add-places`, never by a request
+# bumps the catalog version, so the area indexes are rebuilt with the new places; returns the number added
+def add_missing_places():
+    missing = [
+        location for (location,) in db.session.query(Earthquake.location)
+        .outerjoin(Place, Place.location == Earthquake.location).filter(Place.location.is_(None)).distinct()
+    ]
+    if missing:
+        save_places(missing)
+        bump_catalog_version()
+        db.session.commit()
+    return len(missing)
+
+
+# get the area index of the catalog (needs an app context)
+# read-only: earthquakes whose location is not in the gazetteer yet are simply not indexed by area
+def get_area_index():
+    global catalog_index, catalog_version
+
+    # every write to the catalog (new earthquakes, or revised locations) bumps its version
+    version = read_catalog_version()
+
+    with catalog_lock:
+        count_cache("area_index", catalog_index is not None and version == catalog_version)
+        if catalog_index is None or version != catalog_version:
+            rows = (db.session.query(Earthquake.id, Earthquake.date_time, Earthquake.magnitude,
+                                     Place.municipality, Place.province)
+                    .outerjoin(Place, Place.location == Earthquake.location)
+                    .order_by(Earthquake.date_time, Earthquake.id).all())
+            columns = zip(*rows) if rows else ((), (), (), (), ())
+            catalog_index = AreaIndex(*columns)
+            catalog_version = version
+
+        return catalog_index
@@ -0,0 +1,60 @@
+import os
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+"""
+Prometheus metrics of the app, exposed on /metrics.
+1. aisle_stage_duration_seconds - histogram of every stage: upstream fetch, html parse, bulletin enrichment,
+   catalog upsert, redis get/set, gemini calls, map payload and template render
+2. aisle_request_duration_seconds - histogram of the requests per endpoint (until the response is returned,
+   so streamed responses only count the time to the first byte)
+3. aisle_cache_requests_total - hits and misses of every cache (in-process and redis tiers of Cache,
+   the published snapshot, the http validators, stored bulletins and summaries, response memo, spatial index)
+4. aisle_event_clients - browsers connected to the live earthquake stream
+
+With many worker processes (gunicorn), set PROMETHEUS_MULTIPROC_DIR to a shared empty folder,
+so /metrics adds up the metrics of all workers.
+"""
+
+# histogram buckets, from half a millisecond (in-process caches) to 30 seconds (model calls, slow upstream)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+stage_seconds = Histogram(
+    "aisle_stage_duration_seconds", "Duration of each stage of the app", ["stage"], buckets=BUCKETS,
+)
+request_seconds = Histogram(
+    "aisle_request_duration_seconds", "Duration of the requests", ["endpoint", "method", "status"], buckets=BUCKETS,
+)
+cache_requests = Counter(
+    "aisle_cache_requests_total", "Cache lookups by cache and result (hit or miss)", ["cache", "result"],
+)
+event_clients = Gauge(
+    "aisle_event_clients", "Browsers connected to the live earthquake stream", multiprocess_mode="livesum",
+)
+
+
+# time a stage, as a context manager or a decorator, e.g. `with timed("parse"):`
+def timed(stage):
+    return stage_seconds.labels(stage).time()
+
+
+# record the duration of a stage that was measured by hand (e.g. across the chunks of a stream)
+def observe(stage, seconds):
+    stage_seconds.labels(stage).observe(seconds)
+
+
+# count lookups of a cache: hit is a bool, count is the number of lookups it stands for
+def count_cache(cache, hit, count=1):
+    if count:
+        cache_requests.labels(cache, "hit" if hit else "miss").inc(count)
+
+
+# metrics in the prometheus text format, as (body, content type)
+def render_metrics():
+    registry = REGISTRY
+
+    # add up the metrics written by every worker process
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
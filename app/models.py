@@ -1,5 +1,9 @@
+import sqlite3
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 # initialize the application's database
 db = SQLAlchemy()
@@ -9,4 +13,80 @@ class Users(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
     password = db.Column(db.String(20), nullable=False)
-    
\ No newline at end of file
+    
+# initialize the Earthquake database (the catalog filled by the ingestion worker)
+class Earthquake(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # the bulletin link identifies an earthquake, so it is unique
+    detail_link = db.Column(db.String(255), unique=True, nullable=False)
+    date_time = db.Column(db.DateTime, nullable=False, index=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    depth = db.Column(db.Float, nullable=False)
+    magnitude = db.Column(db.Float, nullable=False, index=True)
+    location = db.Column(db.String(255), nullable=False)
+
+    # index the coordinates together for bounding box queries
+    __table_args__ = (
+        db.Index("ix_earthquake_coordinates", "latitude", "longitude"),
+    )
+
+
+# initialize the CatalogVersion database (a single row), bumped by every write to the Earthquake table,
+# so responses and indexes built from the catalog know when it changed (whoever wrote it: worker or backfill)
+class CatalogVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # version of the last write that changed known earthquakes (not only added new ones)
+    changed_version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# initialize the Place database (the gazetteer: every location string of the catalog, parsed once)
+# e.g. "015  km S 22° W of City Of Bogo (Cebu)" is 15 km, bearing "S 22° W", City Of Bogo, Cebu
+class Place(db.Model):
+    location = db.Column(db.String(255), primary_key=True)
+    distance_km = db.Column(db.Float)
+    bearing = db.Column(db.String(16))
+    # bearing in degrees clockwise from north
+    azimuth = db.Column(db.Float)
+    municipality = db.Column(db.String(255), index=True)
+    province = db.Column(db.String(255), index=True)
+
+
+# initialize the Bulletin database (details of the official bulletin of each earthquake)
+# bulletins never change once published, so they are fetched once and kept permanently
+class Bulletin(db.Model):
+    detail_link = db.Column(db.String(255), primary_key=True)
+    reported_intensities = db.Column(db.Text)
+    expected_damage = db.Column(db.Text)
+    expected_aftershocks = db.Column(db.Text)
+
+
+# initialize the BulletinFailure database (bulletins that could not be fetched yet)
+# a failed bulletin is retried with a growing delay, and given up after a few attempts (or at once on a 404)
+class BulletinFailure(db.Model):
+    detail_link = db.Column(db.String(255), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    # not fetched again before this time; None once given up
+    retry_after = db.Column(db.DateTime)
+
+
+# initialize the Summary database (ai summaries of the bulletins)
+# the key is a hash of the bulletin fields and the prompt version, so a summary never goes out of date
+class Summary(db.Model):
+    key = db.Column(db.String(64), primary_key=True)
+    detail_link = db.Column(db.String(255), index=True)
+    prompt_version = db.Column(db.String(12), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+# use write-ahead logging for sqlite, so the ingestion worker can write while requests read
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
@@ -0,0 +1,193 @@
+import calendar
+import json
+import re
+import sys
+from dataclasses import dataclass, replace
+from datetime import datetime
+from functools import lru_cache
+
+"""
+Compact, typed record of one earthquake of the PHIVOLCS feed, used by the whole ingestion pipeline
+(parsers, catalog upserts, bulletin enrichment, snapshot).
+1. the scraped strings are parsed once, when the row is read: date-time, coordinates, depth and magnitude
+2. __slots__ instead of a dict per earthquake, so large lists take less memory
+3. the location strings are interned, so the many earthquakes of the same place share one string
+4. dumps() serializes lists of records with orjson when installed (else json)
+5. parse_location() splits a location into distance, bearing, municipality and province (see gazetteer.py)
+
+The published snapshot keeps the json shape of to_dict(), with numbers instead of the scraped strings.
+"""
+
+# orjson is optional; json is always available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# date-time format of the phivolcs feed and csv files, e.g. "29 October 2025 - 02:25 PM" (used by every module)
+DATE_TIME_FORMAT = "%d %B %Y - %I:%M %p"
+
+# month numbers by english name, for the fast date-time parser
+MONTHS = {name: number for number, name in enumerate(calendar.month_name) if name}
+
+# fields added by the bulletin enrichment
+BULLETIN_FIELDS = ("reported_intensities", "expected_damage", "expected_aftershocks")
+
+
+# parse a feed date-time, e.g. "29 October 2025 - 02:25 PM"
+# splitting the fixed format is several times faster than strptime, which is kept for anything unusual
+def parse_date_time(text):
+    try:
+        day, month, year, _, clock, period = text.split()
+        hour, minute = clock.split(":")
+        hour = int(hour) % 12 + (12 if period.upper() == "PM" else 0)
+        return datetime(int(year), MONTHS[month], int(day), hour, int(minute))
+    except (KeyError, ValueError):
+        return datetime.strptime(text, DATE_TIME_FORMAT)
+
+
+# distance, bearing ("S 22° W", "N", or "West"), place name and the names in parentheses after it
+LOCATION_PATTERN = re.compile(
+    r"^\s*(?P<distance>\d+(?:\.\d+)?)\s*km\s+"
+    r"(?P<bearing>North|South|East|West|[NSEW](?:\s*\d+(?:\.\d+)?\s*°\s*[NSEW])?)\s+of\s+"
+    r"(?P<name>[^()]+?)\s*(?P<parentheses>(?:\([^()]*\)\s*)*)$",
+    re.IGNORECASE,
+)
+
+# the province alone, for locations that do not follow the pattern
+PROVINCE_PATTERN = re.compile(r"\(([^()]*)\)\s*$")
+
+# names in parentheses
+PARENTHESES_PATTERN = re.compile(r"\(([^()]*)\)")
+
+# azimuth (degrees clockwise from north) of the cardinal directions
+AZIMUTHS = {"N": 0.0, "E": 90.0, "S": 180.0, "W": 270.0}
+
+
+# azimuth of a bearing: a cardinal direction, or a quadrant bearing such as "S 22° W" (22° west of south)
+def bearing_azimuth(bearing):
+    if len(bearing) == 1:
+        return AZIMUTHS[bearing]
+
+    angle = float(bearing[1:-1].replace("°", ""))
+    start, end = bearing[0], bearing[-1]
+    if start == "N":
+        return angle if end == "E" else (360.0 - angle) % 360.0
+    return 180.0 - angle if end == "E" else 180.0 + angle
+
+
+# parse a location string, e.g. "015  km S 22° W of City Of Bogo (Cebu)", into the columns of the Place table
+# (distance_km, bearing, azimuth, municipality, province; missing parts are None)
+# the same places come back again and again, so parsed locations are kept (the dict is shared, do not change it)
+@lru_cache(maxsize=65536)
+def parse_location(location):
+    match = LOCATION_PATTERN.match(location)
+    if match is None:
+        province = PROVINCE_PATTERN.search(location)
+        return {
+            "distance_km": None,
+            "bearing": None,
+            "azimuth": None,
+            "municipality": None,
+            "province": (province.group(1).strip() or None) if province else None,
+        }
+
+    # "West" and "s 22 ° w" become "W" and "S 22° W"
+    bearing = match.group("bearing").upper()
+    bearing = bearing[0] if bearing.isalpha() else re.sub(r"\s*(\d+(?:\.\d+)?)\s*°\s*", r" \1° ", bearing)
+
+    # "City Of Bogo (Cebu)": municipality and province, "City Of Davao": a city without province,
+    # "Balut Island (Municipality Of Sarangani) (Davao Occidental)": a landmark, its municipality and province
+    names = [" ".join(name.split()) for name in PARENTHESES_PATTERN.findall(match.group("parentheses"))]
+    municipality = names[-2] if len(names) >= 2 else " ".join(match.group("name").split())
+    if municipality.lower().startswith("municipality of "):
+        municipality = municipality[len("municipality of "):]
+
+    return {
+        "distance_km": float(match.group("distance")),
+        "bearing": bearing,
+        "azimuth": bearing_azimuth(bearing.replace(" ", "")),
+        "municipality": municipality or None,
+        "province": (names[-1] or None) if names else None,
+    }
+
+
+@dataclass(slots=True, frozen=True)
+class EarthquakeRecord:
+    date_time: datetime
+    detail_link: str | None
+    latitude: float
+    longitude: float
+    depth: float
+    magnitude: float
+    location: str
+    # details of the bulletin, once fetched (enriched)
+    enriched: bool = False
+    reported_intensities: str | None = None
+    expected_damage: str | None = None
+    expected_aftershocks: str | None = None
+    # context of its earthquake sequence (see clustering.py), None if not in one
+    cluster: dict | None = None
+
+    # build a record from the scraped texts; returns None if the row cannot be parsed
+    @classmethod
+    def from_texts(cls, date_time, detail_link, latitude, longitude, depth, magnitude, location):
+        try:
+            return cls(
+                date_time=parse_date_time(date_time),
+                detail_link=detail_link,
+                latitude=float(latitude),
+                longitude=float(longitude),
+                depth=float(depth),
+                magnitude=float(magnitude),
+                location=sys.intern(location),
+            )
+        except (TypeError, ValueError):
+            return None
+
+    # build a record back from its to_dict() json
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.from_texts(
+            data["date_time"], data["detail_link"], data["latitude"], data["longitude"],
+            data["depth"], data["magnitude"], data["location"],
+        )
+        if record is not None and "reported_intensities" in data:
+            record = record.with_bulletin({field: data.get(field) for field in BULLETIN_FIELDS})
+        if record is not None and data.get("cluster"):
+            record = record.with_cluster(data["cluster"])
+        return record
+
+    # copy of the record with the details of its bulletin
+    def with_bulletin(self, details):
+        return replace(self, enriched=True, **{field: details.get(field) for field in BULLETIN_FIELDS})
+
+    # copy of the record with the context of its earthquake sequence
+    def with_cluster(self, cluster):
+        return replace(self, cluster=cluster)
+
+    # json-ready dict; the bulletin fields are only there once enriched, the cluster only if in one
+    def to_dict(self):
+        data = {
+            "date_time": self.date_time.strftime(DATE_TIME_FORMAT),
+            "detail_link": self.detail_link,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "depth": self.depth,
+            "magnitude": self.magnitude,
+            "location": self.location,
+        }
+        if self.enriched:
+            data["reported_intensities"] = self.reported_intensities
+            data["expected_damage"] = self.expected_damage
+            data["expected_aftershocks"] = self.expected_aftershocks
+        if self.cluster is not None:
+            data["cluster"] = self.cluster
+        return data
+
+
+# serialize a json-ready value (e.g. a snapshot of to_dict() records) to utf-8 bytes
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
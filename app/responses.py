@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+import threading
+from flask import Response, request
+from .metrics import count_cache
+
+"""
+Helpers for cacheable, compressed json responses of the api routes.
+1. strong etags derived from the snapshot version, so a repeat poll costs a 304 without querying or serializing
+2. brotli (if installed) or gzip encoding of the body, negotiated with Accept-Encoding
+3. a small in-process memo of encoded bodies per etag, so the same page is serialized once per snapshot
+4. bodies gzipped ahead of time (precompressed_json), sent as is to clients accepting gzip
+"""
+
+# brotli is optional; gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024 # bytes
+
+# maximum number of encoded bodies kept in memory
+MEMO_SIZE = 256
+
+# encoded bodies by etag
+memo = {}
+memo_lock = threading.Lock()
+
+
+# pick the best encoding the client accepts (None for identity)
+def negotiate_encoding():
+    if brotli is not None and "br" in request.accept_encodings:
+        return "br"
+    if "gzip" in request.accept_encodings:
+        return "gzip"
+    return None
+
+
+# strong etag of a representation: hash of its parts (e.g. snapshot version and query), plus the encoding
+def make_etag(*parts, encoding=None):
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:32]
+    return f"{digest}-{encoding}" if encoding else digest
+
+
+def encode_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+# build a json response identified by the given version parts
+# build_payload is only called if the client does not already have this representation (and it is not memoized)
+def cached_json(version_parts, build_payload):
+    encoding = negotiate_encoding()
+    etag = make_etag(*version_parts, encoding=encoding)
+
+    # the client already has this exact representation
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        return response
+
+    with memo_lock:
+        cached = memo.get(etag)
+    count_cache("response_memo", cached is not None)
+
+    if cached is None:
+        body = json.dumps(build_payload(), separators=(",", ":")).encode("utf-8")
+
+        # only compress bodies that are large enough
+        used_encoding = encoding if encoding and len(body) >= MIN_COMPRESS_SIZE else None
+        if used_encoding:
+            body = encode_body(body, used_encoding)
+        cached = (body, used_encoding)
+
+        with memo_lock:
+            # drop the oldest bodies when full (dicts keep insertion order)
+            while len(memo) >= MEMO_SIZE:
+                memo.pop(next(iter(memo)))
+            memo[etag] = cached
+
+    body, used_encoding = cached
+    response = Response(body, mimetype="application/json")
+    if used_encoding:
+        response.headers["Content-Encoding"] = used_encoding
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# build a json response from a body gzipped ahead of time, identified by the given version parts
+def precompressed_json(version_parts, gzipped_body):
+    encoding = "gzip" if "gzip" in request.accept_encodings else None
+    etag = make_etag(*version_parts, encoding=encoding)
+
+    # the client already has this exact representation
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    # rare clients without gzip support get the decompressed body
+    elif encoding is None:
+        response = Response(gzip.decompress(gzipped_body), mimetype="application/json")
+    else:
+        response = Response(gzipped_body, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
@@ -1,29 +1,50 @@
-from flask import Blueprint, redirect, render_template, request, url_for
+from flask import Blueprint, Response, current_app, g, jsonify, redirect, render_template, request, stream_with_context, url_for
 from flask_login import current_user, login_required, login_user, logout_user
-from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
 from .models import Users, db
 from .services import fetch_earthquake_view
-from .api.phivolcs import get_all_earthquakes, get_latest_earthquake
-from .api.googleai import generate_summary, fetch_summary
+from .catalog import get_earthquakes, query_earthquakes, read_catalog_version, to_dict
+from .responses import cached_json, precompressed_json
+from .spatial import get_catalog_index
+from .archive import get_archive
+from .clustering import get_cluster_engine
+from .gazetteer import get_area_index
+from .metrics import render_metrics, request_seconds, timed
+from datetime import datetime
+from .api.phivolcs import find_earthquake, get_latest_earthquake, read_geojson
+from .api.googleai import stream_summary
+from .api.events import broadcaster
 import regex as re
 import json
+import base64
+import math
+import queue
+import time
 
 
 # contain the routes inside a blueprint
 bp = Blueprint("main", __name__)
 
-# sample function for executing a function before the requested route
+# start timing the request, before the requested route
 @bp.before_request
 def before_request():
-    print("What is love?")
+    g.request_started = time.perf_counter()
 
-# sample function for executing a function AFTER the requested route
+# record the duration of the request AFTER the requested route (see /metrics)
+# streamed responses are only timed until their first byte
 @bp.after_request
 def after_request(response):
-    print(response)
+    started = g.pop("request_started", None)
+    if started is not None:
+        request_seconds.labels(request.endpoint or "unknown", request.method, response.status_code).observe(time.perf_counter() - started)
     return response
 
+# prometheus metrics: stage durations, request durations, cache hits and misses
+@bp.route('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 # registration route; for checking user details' logic too
 @bp.route('/register', methods = ["GET", "POST"])
 def register():
@@ -103,14 +124,387 @@ def home():
 
 # dashboard route
 # to access the dashboard, a user must be signed in
+# the page only shows the latest earthquake; the slow parts (ai summary, maps) are loaded by the browser afterwards,
+# each on its own, so a slow or failed part never blocks the page or the other parts
 @bp.route('/dashboard')
 @login_required
 def dashboard():
     # get json value from api, and typecast to dict
+    # the data comes from the snapshot published by the ingestion worker, so this never scrapes phivolcs
     earthquake_json = get_latest_earthquake().get_json()
-    earthquake = earthquake_json['data']
-    summary = fetch_summary(earthquake)
-    map_view = Markup(fetch_earthquake_view(earthquake['latitude'], earthquake['longitude']))
-    return render_template("dashboard.html", username=current_user.username, data=earthquake_json, summary=summary, view=map_view)
-    
+    earthquake = earthquake_json.get('data')
+
+    # nothing to map until the worker has published a snapshot
+    map_view = None
+    if earthquake:
+        # the map is drawn by the browser from this small json payload
+        map_view = fetch_earthquake_view(earthquake['latitude'], earthquake['longitude'])
+    with timed("template"):
+        return render_template("dashboard.html", username=current_user.username, data=earthquake_json, view=map_view)
+
+
+# summary of an earthquake of the snapshot, streamed as server-sent events while the ai writes it
+# a summary that is already stored is sent right away, as one chunk
+# events: "data" with {"text": chunk} as many times as needed, then "done" (or "error" with {"error": message})
+# usage: /api/summary/stream?detail_link=<bulletin link>
+@bp.route('/api/summary/stream')
+@login_required
+def summary_stream():
+    # only earthquakes of the published snapshot can be summarized
+    earthquake = find_earthquake(request.args.get("detail_link"))
+    if earthquake is None:
+        return jsonify({
+            "success": False,
+            "message": "Error streaming earthquake summary",
+            "error": "Unknown earthquake"
+        }), 404
+
+    def events():
+        try:
+            for chunk in stream_summary(earthquake):
+                yield f"data: {json.dumps({'text': chunk})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    # stream_with_context keeps the app context (database) while streaming
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# send a comment this often on the live stream, so proxies keep it open and closed connections are noticed
+HEARTBEAT_INTERVAL = 15 # seconds
+
+# new earthquakes, pushed as server-sent events as soon as the ingestion worker scrapes them
+# events: "earthquake" with {"earthquakes": [newest first], "last_updated"}
+# only when LIVE_EVENTS is enabled (config.py), for at most LIVE_EVENTS_MAX_CLIENTS browsers per process
+# usage: /api/events/stream
+@bp.route('/api/events/stream')
+@login_required
+def earthquake_events():
+    if not current_app.config["LIVE_EVENTS"]:
+        return jsonify({
+            "success": False,
+            "message": "Live earthquake events are disabled",
+            "error": "set LIVE_EVENTS=1 (needs a threaded or gevent server)"
+        }), 404
+
+    # subscribe before the response starts, so a full process answers with an error instead of an empty stream
+    client = broadcaster.subscribe(current_app.config["LIVE_EVENTS_MAX_CLIENTS"])
+    if client is None:
+        return jsonify({
+            "success": False,
+            "message": "Too many live connections, please try again later",
+            "error": "live event connection limit reached"
+        }), 503
+
+    def events():
+        # browsers reconnect after 5 seconds if the connection drops
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                message = client.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: earthquake\ndata: {message}\n\n"
+
+    # no app context is kept: the stream never touches the database
+    response = Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # free the slot when the connection closes, even if the stream never started
+    response.call_on_close(lambda: broadcaster.unsubscribe(client))
+    return response
+
+
+# maximum number of earthquakes returned by the spatial queries
+SPATIAL_LIMIT = 1000
+
+
+# parse a number of the query, rejecting nan and infinities (ValueError)
+# a nan filter would silently match nothing, and an infinite coordinate has no meaning
+def finite_float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"expected a finite number, got {value}")
+    return number
+
+
+# parse a latitude (bound 90) or longitude (bound 180) of the query, rejecting values out of range (ValueError)
+def coordinate(value, bound):
+    number = finite_float(value)
+    if not -bound <= number <= bound:
+        raise ValueError(f"expected a coordinate between {-bound} and {bound}, got {value}")
+    return number
+
+# earthquakes within radius_km of a point, nearest first
+# usage: /api/earthquakes/nearby?lat=11.05&lon=124.0&radius_km=50
+@bp.route('/api/earthquakes/nearby')
+def earthquakes_nearby():
+    try:
+        latitude = coordinate(request.args["lat"], 90)
+        longitude = coordinate(request.args["lon"], 180)
+        radius_km = finite_float(request.args.get("radius_km", 50))
+        if radius_km <= 0:
+            raise ValueError("radius_km must be positive")
+        limit = min(int(request.args.get("limit", SPATIAL_LIMIT)), SPATIAL_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+    except (KeyError, ValueError) as e:
+        return jsonify({
+            "success": False,
+            "message": "Invalid query, expected lat, lon and optional radius_km and limit",
+            "error": str(e)
+        }), 400
+
+    ids, distances = get_catalog_index().within_radius(latitude, longitude, radius_km)
+
+    # attach the distance to every earthquake
+    distance_by_id = dict(zip(ids[:limit].tolist(), distances[:limit].tolist()))
+    earthquakes = [
+        {**to_dict(earthquake), "distance_km": round(distance_by_id[earthquake.id], 2)}
+        for earthquake in get_earthquakes(distance_by_id)
+    ]
+
+    return jsonify({
+        "success": True,
+        "data": earthquakes,
+        "count": len(ids)
+    })
+
+# earthquakes inside a bounding box
+# usage: /api/earthquakes/bbox?min_lat=10.5&min_lon=123.5&max_lat=11.5&max_lon=124.5
+@bp.route('/api/earthquakes/bbox')
+def earthquakes_in_bbox():
+    try:
+        min_lat = coordinate(request.args["min_lat"], 90)
+        min_lon = coordinate(request.args["min_lon"], 180)
+        max_lat = coordinate(request.args["max_lat"], 90)
+        max_lon = coordinate(request.args["max_lon"], 180)
+        limit = min(int(request.args.get("limit", SPATIAL_LIMIT)), SPATIAL_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+    except (KeyError, ValueError) as e:
+        return jsonify({
+            "success": False,
+            "message": "Invalid query, expected min_lat, min_lon, max_lat, max_lon and optional limit",
+            "error": str(e)
+        }), 400
+
+    ids = get_catalog_index().within_bbox(min_lat, min_lon, max_lat, max_lon)
+
+    return jsonify({
+        "success": True,
+        "data": [to_dict(earthquake) for earthquake in get_earthquakes(ids[:limit].tolist())],
+        "count": len(ids)
+    })
+
+# narrowest magnitude bin of the archive statistics
+MIN_BIN_WIDTH = 0.1
+
+# aggregated statistics of the historical archive (see archive.py)
+# usage: /api/archive/stats?by=day|province|magnitude&since=2025-10-01&until=2025-11-01&width=0.5
+@bp.route('/api/archive/stats')
+def archive_stats():
+    archive = get_archive()
+    if archive is None:
+        return jsonify({
+            "success": False,
+            "message": "Error fetching archive statistics",
+            "error": "No historical catalog was loaded, run `flask --app run load-archive <csv files>`"
+        }), 404
+
+    try:
+        by = request.args.get("by", "day")
+        since = request.args.get("since")
+        until = request.args.get("until")
+        archive = archive.between(
+            datetime.fromisoformat(since) if since else None,
+            datetime.fromisoformat(until) if until else None,
+        )
+        # magnitudes have one decimal, so narrower bins split nothing (and a zero or tiny width breaks the binning)
+        width = float(request.args.get("width", 1.0))
+        if not MIN_BIN_WIDTH <= width < float("inf"):
+            raise ValueError(f"width must be at least {MIN_BIN_WIDTH}")
+        stats = {
+            "day": archive.per_day,
+            "province": archive.per_province,
+            "magnitude": lambda: archive.per_magnitude_bin(width),
+        }[by]()
+    except (KeyError, ValueError) as e:
+        return jsonify({
+            "success": False,
+            "message": "Invalid query, expected by (day, province or magnitude) and optional since, until and width",
+            "error": str(e)
+        }), 400
+
+    return jsonify({
+        "success": True,
+        "data": stats,
+        "count": len(archive)
+    })
+
+# maximum number of earthquakes returned by the area query
+AREA_LIMIT = 1000
+
+# earthquakes of a province and/or municipality (see gazetteer.py), newest first
+# usage: /api/earthquakes/area?province=Cebu&municipality=City Of Bogo&since=2025-10-01&until=2025-11-01&limit=100
+@bp.route('/api/earthquakes/area')
+def earthquakes_in_area():
+    try:
+        province = request.args.get("province")
+        municipality = request.args.get("municipality")
+        since = request.args.get("since")
+        until = request.args.get("until")
+        limit = min(int(request.args.get("limit", AREA_LIMIT)), AREA_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        ids = get_area_index().query(
+            province,
+            municipality,
+            datetime.fromisoformat(since) if since else None,
+            datetime.fromisoformat(until) if until else None,
+        )
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": "Invalid query, expected province and/or municipality, and optional since, until and limit",
+            "error": str(e)
+        }), 400
+
+    return jsonify({
+        "success": True,
+        "data": [to_dict(earthquake) for earthquake in get_earthquakes(ids[:limit].tolist())],
+        "count": len(ids)
+    })
+
+# number of earthquakes, max magnitude and latest earthquake per province or municipality, most earthquakes first
+# usage: /api/areas?by=province|municipality&since=2025-10-01&until=2025-11-01
+@bp.route('/api/areas')
+def area_counts():
+    try:
+        by = request.args.get("by", "province")
+        since = request.args.get("since")
+        until = request.args.get("until")
+        areas = get_area_index().counts(
+            by,
+            datetime.fromisoformat(since) if since else None,
+            datetime.fromisoformat(until) if until else None,
+        )
+    except (KeyError, ValueError) as e:
+        return jsonify({
+            "success": False,
+            "message": "Invalid query, expected by (province or municipality) and optional since and until",
+            "error": str(e)
+        }), 400
+
+    return jsonify({
+        "success": True,
+        "data": areas,
+        "count": len(areas)
+    })
+
+# maximum number of earthquake sequences returned
+CLUSTER_LIMIT = 100
+
+# largest earthquake sequences (main shock with its foreshocks and aftershocks) of the catalog, see clustering.py
+# usage: /api/clusters?limit=20&min_events=5
+@bp.route('/api/clusters')
+def earthquake_clusters():
+    try:
+        limit = min(int(request.args.get("limit", 20)), CLUSTER_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        min_events = int(request.args.get("min_events", 2))
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": "Invalid query, expected optional limit and min_events",
+            "error": str(e)
+        }), 400
+
+    clusters = get_cluster_engine().largest_clusters(limit, min_events)
+
+    return jsonify({
+        "success": True,
+        "data": clusters,
+        "count": len(clusters)
+    })
+
+# default and maximum page size of the earthquake list
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# encode the position of the last earthquake of a page as an opaque cursor
+def encode_cursor(earthquake):
+    data = json.dumps([earthquake.date_time.isoformat(), earthquake.id])
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    date_time, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return datetime.fromisoformat(date_time), int(id)
+
+# paginated, filterable list of the catalog, newest first
+# usage: /api/earthquakes?since=2025-10-01&min_magnitude=4&bbox=10.5,123.5,11.5,124.5&limit=100&cursor=<next_cursor>
+# responses carry a strong etag per catalog version, so repeat polls get a 304
+@bp.route('/api/earthquakes')
+def earthquakes_list():
+    try:
+        since = request.args.get("since")
+        since = datetime.fromisoformat(since) if since else None
+        min_magnitude = request.args.get("min_magnitude")
+        min_magnitude = finite_float(min_magnitude) if min_magnitude else None
+        bbox = request.args.get("bbox")
+        bbox = bbox.split(",") if bbox else None
+        if bbox is not None:
+            if len(bbox) != 4:
+                raise ValueError("bbox must be min_lat,min_lon,max_lat,max_lon")
+            bbox = tuple(coordinate(value, bound) for value, bound in zip(bbox, (90, 180, 90, 180)))
+        limit = min(int(request.args.get("limit", PAGE_SIZE)), MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor) if cursor else None
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            "success": False,
+            "message": "Invalid query, expected optional since, min_magnitude, bbox, limit and cursor",
+            "error": str(e)
+        }), 400
+
+    def build_payload():
+        # fetch one more than the page, to know if there is a next page
+        earthquakes = query_earthquakes(since, None, min_magnitude, bbox, after, limit + 1)
+        page = earthquakes[:limit]
+
+        return {
+            "success": True,
+            "data": [to_dict(earthquake) for earthquake in page],
+            "next_cursor": encode_cursor(page[-1]) if len(earthquakes) > limit else None,
+        }
+
+    # the catalog version changes on every write (ingestion worker or backfill),
+    # so it identifies the response along with the query
+    query = sorted(request.args.items(multi=True))
+    return cached_json(("catalog", read_catalog_version(), query), build_payload)
+
+# geojson feed of the recent catalog, for the map of all earthquakes
+# built and gzipped once per snapshot by the ingestion worker, so this only sends the stored bytes
+@bp.route('/api/earthquakes.geojson')
+def earthquakes_geojson():
+    version, gzipped_body = read_geojson()
+
+    if gzipped_body is None:
+        return jsonify({
+            "success": False,
+            "message": "Error fetching earthquake map data",
+            "error": "Earthquake data has not been ingested yet"
+        }), 503
 
+    return precompressed_json(("geojson", version), gzipped_body)
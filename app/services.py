@@ -1,53 +1,65 @@
-import folium
-from .api.caching import Cache
+import gzip
+import json
+from .metrics import timed
 
-def generate_earthquake_view(latitude: int, longitude: int):
-    # using folium library to generate and display a map in html
+"""
+The map is drawn in the browser with Leaflet (static/js/script.js), which is cached by the browser.
+The server only sends the marker data as a small json payload, instead of a full folium html document per map.
 
-    # initialize a Map object
-    # the arguments are the coordinates of the designated location and starting zoom of the map
-    m = folium.Map(
-        location=[latitude, longitude],
-        zoom_start=7
-    )
+The map of all recent earthquakes uses a geojson feed, built and gzipped once per ingestion snapshot (build_geojson).
+"""
 
+# starting zoom of the map
+ZOOM_START = 7
+
+def generate_earthquake_view(latitude: float, longitude: float):
+    # build the map's json payload: the coordinates of the designated location, starting zoom of the map, and markers
     """
-    initialize the map's marker Object on the same location
+    initialize the map's marker on the same location
     use details such as:
         1. popup which is the detail shown when pressing the icon
         2. tooltip - detail shown when hovering the icon
-        3. icon - Icon Object with a specified design
+        3. color - the marker's color
     """
-    folium.Marker(
-        location=[latitude, longitude],
-        popup="Epicenter",
-        tooltip=f"{latitude}, {longitude}",
-        icon=folium.Icon(color="orange") # i use orange for the marker's color
-    ).add_to(m) # connect the marker to the map object
-
-    # set the height and width of the map
-    m.get_root().width = "800px"
-    m.get_root().height = "600px"
-
-    # convert the map object into html text
-    iframe = m.get_root()._repr_html_()
-
-    # return the map's html text
-    return iframe
-
-
-# function for caching the earthquake's map and marker
-def fetch_earthquake_view(latitude: int, longitude: int):
-    # store using key of the latitude and longitude
-    # reason: if two earthquakes have the same coordinates, the program can recycle the same map
-    cache = Cache(f"view-{latitude},{longitude}")
-    data = cache.get()
-
-    # if there is cached data, return it
-    if data is not None:
-        return data
-    # if none, generate the data, store it in cache, and return the data
-    else:
-        data = generate_earthquake_view(latitude, longitude)
-        cache.set(data)
-        return data
\ No newline at end of file
+    return {
+        "center": [latitude, longitude],
+        "zoom": ZOOM_START,
+        "markers": [{
+            "latitude": latitude,
+            "longitude": longitude,
+            "popup": "Epicenter",
+            "tooltip": f"{latitude}, {longitude}",
+            "color": "orange", # i use orange for the marker's color
+        }],
+    }
+
+
+# function for getting the earthquake's map and marker
+# the payload is a few bytes and takes microseconds to build, so it is not cached anymore
+@timed("map")
+def fetch_earthquake_view(latitude: float, longitude: float):
+    return generate_earthquake_view(latitude, longitude)
+
+
+# build the gzipped geojson feed of the earthquakes (Earthquake rows of the catalog)
+# this runs once per ingestion snapshot, so requests only send the stored bytes
+def build_geojson(earthquakes):
+    features = [
+        {
+            "type": "Feature",
+            # geojson coordinates are longitude first
+            "geometry": {"type": "Point", "coordinates": [earthquake.longitude, earthquake.latitude]},
+            "properties": {
+                "date_time": earthquake.date_time.isoformat(timespec="minutes"),
+                "depth": earthquake.depth,
+                "magnitude": earthquake.magnitude,
+                "location": earthquake.location,
+                "detail_link": earthquake.detail_link,
+            },
+        }
+        for earthquake in earthquakes
+    ]
+
+    data = json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":"))
+    # no timestamp in the gzip header, so the same feed always gives the same bytes (and version)
+    return gzip.compress(data.encode("utf-8"), compresslevel=9, mtime=0)
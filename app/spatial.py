@@ -0,0 +1,129 @@
+import threading
+import numpy as np
+from .catalog import read_catalog_version
+from .metrics import count_cache
+from .models import Earthquake, db
+
+"""
+Spatial index over the coordinates of the earthquake catalog.
+Points are bucketed into a grid of CELL_SIZE degree cells, sorted by cell,
+so a query only looks at the points of the cells it overlaps (found with a binary search per grid row).
+The candidates are then filtered exactly with vectorized numpy (bounding box, or haversine distance).
+"""
+
+# mean radius of the earth
+EARTH_RADIUS_KM = 6371.0
+
+# size of a grid cell, in degrees (about 55 km at the equator)
+CELL_SIZE = 0.5
+
+# number of columns reserved per grid row in the cell keys (covers -180 to 180 degrees of longitude)
+COLUMNS = int(360 / CELL_SIZE) + 2
+
+
+# distance in km between one point and arrays of points
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class SpatialIndex:
+    # build the index from parallel sequences of ids, latitudes and longitudes
+    def __init__(self, ids, latitudes, longitudes):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+
+        # sort the points by grid cell, so the points of a cell are contiguous
+        keys = self.cell_keys(self.cell_rows(self.latitudes), self.cell_columns(self.longitudes))
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def cell_rows(latitudes):
+        return np.floor((np.asarray(latitudes) + 90) / CELL_SIZE).astype(np.int64)
+
+    @staticmethod
+    def cell_columns(longitudes):
+        return np.floor((np.asarray(longitudes) + 180) / CELL_SIZE).astype(np.int64)
+
+    @staticmethod
+    def cell_keys(rows, columns):
+        return rows * COLUMNS + columns
+
+    # positions (in the original arrays) of the points in the grid cells overlapping the bounding box
+    def candidates(self, min_lat, min_lon, max_lat, max_lon):
+        # clamp the box to the globe, so a huge box never spans more grid rows than exist (a nan box is empty)
+        if not np.isfinite([min_lat, min_lon, max_lat, max_lon]).all():
+            return np.empty(0, dtype=np.int64)
+        min_lat, max_lat = np.clip([min_lat, max_lat], -90, 90)
+        min_lon, max_lon = np.clip([min_lon, max_lon], -180, 180)
+
+        first_row, last_row = self.cell_rows([min_lat, max_lat])
+        first_column, last_column = self.cell_columns([min_lon, max_lon])
+
+        # the cells of one grid row are contiguous in the sorted keys, so each row is one slice
+        rows = np.arange(first_row, last_row + 1)
+        starts = np.searchsorted(self.keys, self.cell_keys(rows, first_column), side="left")
+        ends = np.searchsorted(self.keys, self.cell_keys(rows, last_column), side="right")
+
+        slices = [self.order[start:end] for start, end in zip(starts, ends) if end > start]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+    # ids of the points inside the bounding box
+    def within_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        positions = self.candidates(min_lat, min_lon, max_lat, max_lon)
+
+        latitudes = self.latitudes[positions]
+        longitudes = self.longitudes[positions]
+        inside = (latitudes >= min_lat) & (latitudes <= max_lat) & (longitudes >= min_lon) & (longitudes <= max_lon)
+
+        return self.ids[positions[inside]]
+
+    # ids and distances (in km) of the points within radius_km of the point, nearest first
+    def within_radius(self, latitude, longitude, radius_km):
+        # bounding box of the circle; a degree of latitude is about 111 km, longitude degrees shrink with the latitude
+        lat_delta = radius_km / 111.0
+        lon_delta = radius_km / (111.0 * max(np.cos(np.radians(latitude)), 0.01))
+        positions = self.candidates(
+            max(latitude - lat_delta, -90), max(longitude - lon_delta, -180),
+            min(latitude + lat_delta, 90), min(longitude + lon_delta, 180),
+        )
+
+        distances = haversine_km(latitude, longitude, self.latitudes[positions], self.longitudes[positions])
+        inside = distances <= radius_km
+
+        nearest = np.argsort(distances[inside], kind="stable")
+        return self.ids[positions[inside]][nearest], distances[inside][nearest]
+
+
+# index of the catalog, rebuilt only when the catalog changes
+catalog_index = None
+catalog_version = None
+catalog_lock = threading.Lock()
+
+
+# get the spatial index of the whole catalog (needs an app context)
+def get_catalog_index():
+    global catalog_index, catalog_version
+
+    # every write to the catalog (new earthquakes, or revised coordinates) bumps its version
+    version = read_catalog_version()
+
+    with catalog_lock:
+        count_cache("spatial_index", catalog_index is not None and version == catalog_version)
+        if catalog_index is None or version != catalog_version:
+            rows = db.session.query(Earthquake.id, Earthquake.latitude, Earthquake.longitude).all()
+            ids, latitudes, longitudes = zip(*rows) if rows else ((), (), ())
+            catalog_index = SpatialIndex(ids, latitudes, longitudes)
+            catalog_version = version
+
+        return catalog_index
@@ -0,0 +1,157 @@
+// stream the ai summary into the element, if the page asks for it (data-stream-url)
+function streamSummary(element) {
+    const url = element.dataset.streamUrl;
+    if (!url) {
+        return;
+    }
+
+    element.textContent = "Loading summary...";
+    let started = false;
+
+    const source = new EventSource(url);
+
+    // append every chunk of text as soon as it arrives
+    source.onmessage = (event) => {
+        if (!started) {
+            element.textContent = "";
+            started = true;
+        }
+        element.textContent += JSON.parse(event.data).text;
+    };
+
+    source.addEventListener("done", () => source.close());
+
+    source.addEventListener("error", (event) => {
+        source.close();
+        const error = event.data ? JSON.parse(event.data).error : "connection lost";
+        element.textContent = `Error generating earthquake summary. Please refer to the original bulletin for details. error: ${error}`;
+    });
+}
+
+// leaflet shows string content as html: wrap text in an element, so a location is always shown as text
+function textElement(text) {
+    const element = document.createElement("span");
+    element.textContent = text;
+    return element;
+}
+
+// draw the map from its json payload (data-map): center, zoom, and markers
+function drawMap(element) {
+    const view = JSON.parse(element.dataset.map);
+
+    const map = L.map(element).setView(view.center, view.zoom);
+    L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+        maxZoom: 19,
+        attribution: "&copy; OpenStreetMap contributors",
+    }).addTo(map);
+
+    for (const marker of view.markers) {
+        L.circleMarker([marker.latitude, marker.longitude], {
+            radius: 10,
+            color: marker.color,
+            fillColor: marker.color,
+            fillOpacity: 0.8,
+        })
+            .bindPopup(textElement(marker.popup))
+            .bindTooltip(textElement(marker.tooltip))
+            .addTo(map);
+    }
+
+    return map;
+}
+
+// color of an earthquake by depth (km): shallow, intermediate, deep
+function depthColor(depth) {
+    if (depth < 70) {
+        return "#d7301f";
+    }
+    if (depth < 300) {
+        return "#fc8d59";
+    }
+    return "#4575b4";
+}
+
+// draw every earthquake of the geojson feed (data-geojson-url) in marker clusters
+async function drawCatalogMap(element) {
+    const map = L.map(element).setView([12.5, 122.5], 5);
+    L.tileLayer("https://tile.openstreetmap.org/{z}/{x}/{y}.png", {
+        maxZoom: 19,
+        attribution: "&copy; OpenStreetMap contributors",
+    }).addTo(map);
+
+    const response = await fetch(element.dataset.geojsonUrl);
+    if (!response.ok) {
+        element.textContent = "Earthquake map data is not available yet.";
+        return;
+    }
+
+    // canvas rendering and chunked clustering keep thousands of points smooth
+    const renderer = L.canvas();
+    const clusters = L.markerClusterGroup({ chunkedLoading: true, disableClusteringAtZoom: 10 });
+
+    const layer = L.geoJSON(await response.json(), {
+        pointToLayer: (feature, latlng) => {
+            const properties = feature.properties;
+            return L.circleMarker(latlng, {
+                renderer: renderer,
+                radius: Math.max(3, properties.magnitude * 2.5),
+                color: depthColor(properties.depth),
+                fillColor: depthColor(properties.depth),
+                fillOpacity: 0.7,
+                weight: 1,
+            // built when first shown, not for every marker up front
+            }).bindTooltip(() => textElement(`M${properties.magnitude} - ${properties.location} (${properties.date_time})`));
+        },
+    });
+
+    clusters.addLayer(layer);
+    map.addLayer(clusters);
+    return map;
+}
+
+// listen to the live stream (data-events-url) and show an alert for every new earthquake
+function listenForEarthquakes(element) {
+    const source = new EventSource(element.dataset.eventsUrl);
+
+    source.addEventListener("earthquake", (event) => {
+        const earthquakes = JSON.parse(event.data).earthquakes;
+        if (!earthquakes.length) {
+            return;
+        }
+
+        // the newest earthquake comes first
+        const latest = earthquakes[0];
+        element.textContent = `New earthquake: magnitude ${latest.magnitude}, ${latest.location} (${latest.date_time}). `;
+        if (earthquakes.length > 1) {
+            element.textContent += `${earthquakes.length - 1} more since the last update. `;
+        }
+
+        const reload = document.createElement("a");
+        reload.href = window.location.href;
+        reload.textContent = "Reload the dashboard";
+        element.appendChild(reload);
+        element.hidden = false;
+    });
+}
+
+// load one part of the page; a failed part shows its error without stopping the other parts
+async function loadPart(id, load) {
+    const element = document.getElementById(id);
+    if (!element) {
+        return;
+    }
+
+    try {
+        await load(element);
+    } catch (error) {
+        element.textContent = `Could not load this part of the page: ${error.message}`;
+    }
+}
+
+// every part loads at the same time, so the page is as slow as its slowest part, not the sum of all parts
+document.addEventListener("DOMContentLoaded", () => {
+    loadPart("alert", listenForEarthquakes);
+    loadPart("summary", streamSummary);
+    loadPart("map", drawMap);
+    loadPart("catalog-map", drawCatalogMap);
+});
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+# run from anywhere: make the app package importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.api.parsers import BACKENDS, iter_earthquakes
+import fixtures
+
+"""
+Parity and speed check of the parser backends in app/api/parsers.py.
+Every backend must give the exact same earthquakes as the bs4 extractor (the default backend),
+on the fixed and synthetic pages, the broken markup edge cases,
+and the live pages captured in benchmarks/fixtures/captured/ (see fixtures/__init__.py).
+usage: python benchmarks/bench_parser.py
+"""
+
+# number of timed runs per backend and page
+REPEAT = 5
+
+
+# best time of a few runs, in milliseconds
+def best_time(func, *args):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    pages = {
+        "fixture (100 rows)": fixtures.load("phivolcs_home.html"),
+        "synthetic (500 rows)": fixtures.synthetic_home(500),
+        "synthetic (5000 rows)": fixtures.synthetic_home(5000),
+        **{f"edge case: {name}": html for name, html in fixtures.edge_cases().items()},
+        **{f"captured: {name}": html for name, html in fixtures.captured().items()},
+    }
+
+    if not fixtures.captured():
+        print("no captured pages in benchmarks/fixtures/captured/, parity is only checked on generated markup")
+
+    failed = False
+
+    for page_name, html in pages.items():
+        # the default extractor is the reference output
+        expected = list(iter_earthquakes(html, "bs4"))
+        print(f"{page_name}: {len(expected)} earthquakes")
+
+        for backend in BACKENDS:
+            try:
+                result = list(iter_earthquakes(html, backend))
+            except ImportError as e:
+                print(f"  {backend:>6}: skipped ({e})")
+                continue
+
+            same = result == expected
+            failed = failed or not same
+
+            ms = best_time(lambda: list(iter_earthquakes(html, backend)))
+            print(f"  {backend:>6}: {ms:8.2f} ms  parity: {'ok' if same else 'MISMATCH'}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
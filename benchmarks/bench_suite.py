@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import offline
+import fixtures
+
+"""
+Offline benchmark suite of the hot paths of the app, with saved baselines to catch regressions.
+Everything runs in this process without network (see offline.py): fakeredis, fixture pages, a stubbed gemini client.
+
+usage:
+    pip install -r benchmarks/requirements.txt      (fakeredis, and lupa for its lua scripts)
+    python benchmarks/bench_suite.py                 compare against the saved baseline
+    python benchmarks/bench_suite.py --save          run and save the results as the new baseline
+    python benchmarks/bench_suite.py --only cache    run only the benchmarks whose name contains "cache"
+
+The baseline holds the median time of every benchmark, in milliseconds.
+A benchmark regresses when it is slower than its baseline by more than the tolerance (and the noise floor).
+Baselines depend on the machine, so save a new one before comparing on a different machine.
+"""
+
+# default baseline file, committed with the benchmarks
+BASELINE_PATH = os.path.join(offline.BENCHMARKS_DIR, "baselines", "baseline.json")
+
+# a benchmark regresses if its median is more than this factor of the baseline
+TOLERANCE = 1.5
+
+# differences below this are noise, never regressions
+NOISE_FLOOR = 0.05 # milliseconds
+
+# untimed runs before measuring (imports, caches, lazy initialization)
+WARMUP = 2
+
+
+# time a function: runs it `repeat` times, returns the median and best time in milliseconds
+def measure(func, repeat):
+    for _ in range(WARMUP):
+        func()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(times), min(times)
+
+
+# columns of a synthetic year of earthquakes for the cluster engine, oldest first:
+# background earthquakes spread over the philippines, plus a few swarms of aftershocks around large main shocks
+def synthetic_catalog(background=50000, swarms=10, swarm_size=1000, seed=7):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2025-01-01T00:00:00")
+    year = 365 * 24 * 60 * 60
+
+    seconds = [rng.integers(0, year, background)]
+    latitudes = [rng.uniform(5.0, 19.0, background)]
+    longitudes = [rng.uniform(119.0, 127.0, background)]
+    magnitudes = [np.round(rng.exponential(0.5, background) + 1.5, 1)]
+
+    for _ in range(swarms):
+        origin = rng.integers(0, year - 60 * 24 * 60 * 60)
+        latitude, longitude = rng.uniform(6.0, 18.0), rng.uniform(120.0, 126.0)
+        # omori-like delays: many aftershocks early, fewer later
+        seconds.append(np.concatenate([[origin], origin + (rng.pareto(1.1, swarm_size - 1) * 600).astype(np.int64)]))
+        latitudes.append(latitude + np.concatenate([[0], rng.normal(0, 0.05, swarm_size - 1)]))
+        longitudes.append(longitude + np.concatenate([[0], rng.normal(0, 0.05, swarm_size - 1)]))
+        magnitudes.append(np.concatenate([[6.5], np.round(rng.exponential(0.5, swarm_size - 1) + 1.5, 1)]))
+
+    seconds = np.concatenate(seconds)
+    order = np.argsort(seconds, kind="stable")
+    count = len(order)
+
+    return (
+        np.arange(1, count + 1),
+        [f"synthetic/{i}.html" for i in range(count)],
+        start + seconds[order].astype("timedelta64[s]"),
+        np.concatenate(latitudes)[order],
+        np.concatenate(longitudes)[order],
+        np.concatenate(magnitudes)[order],
+        ["Synthetic"] * count,
+    )
+
+
+# build the benchmarks as (name, function, repeat), sharing one offline app
+def build_benchmarks():
+    app, session, gemini = offline.setup()
+
+    from bs4 import BeautifulSoup
+    from app.api import phivolcs
+    from app.api.caching import Cache, local_cache
+    from app.clustering import ClusterEngine
+    from app.gazetteer import AreaIndex
+    from app.records import parse_date_time, parse_location
+    from app.services import generate_earthquake_view
+
+    fixture_home = fixtures.load("phivolcs_home.html")
+    large_home = fixtures.synthetic_home(5000)
+    # newest detail link already ingested when one new row is on the page
+    second_link = phivolcs.parse_earthquakes(large_home)[1].detail_link
+    bulletin_html = fixtures.load("phivolcs_bulletin.html")
+
+    # publish a snapshot, so the dashboard has data (the request path never scrapes)
+    with app.app_context():
+        snapshot = phivolcs.refresh_snapshot()
+    latest = snapshot["latest"]
+
+    # the paragraph of the bulletin that get_info_text reads
+    soup = BeautifulSoup(bulletin_html, "html.parser")
+    intensities = next(p for p in soup.find_all("p") if "Reported" in p.get_text() and "Intensities" in p.get_text())
+
+    small_value = "x" * 1024
+    large_value = json.dumps(snapshot["data"])
+
+    def cache_set(value):
+        Cache("benchmark-cache", ttl=300).set(value)
+
+    # read from redis, skipping the in-process tier
+    def cache_get_redis():
+        local_cache.clear()
+        Cache("benchmark-cache", ttl=300).get()
+
+    test_client = offline.signed_in_client(app)
+    summary_url = f"/api/summary/stream?detail_link={latest['detail_link']}"
+
+    # the summary is generated once by the stubbed gemini client, then served from the cache
+    test_client.get(summary_url).get_data()
+
+    def get(url):
+        response = test_client.get(url)
+        response.get_data()
+        assert response.status_code == 200, (url, response.status_code)
+
+    cache_set(small_value)
+
+    catalog = synthetic_catalog()
+
+    # area index of the csv month, oldest first
+    rows = sorted(fixtures.csv_rows(), key=lambda row: parse_date_time(row[0]))
+    places = [parse_location(row[5]) for row in rows]
+    area_index = AreaIndex(
+        range(len(rows)), [parse_date_time(row[0]) for row in rows], [float(row[4]) for row in rows],
+        [place["municipality"] for place in places], [place["province"] for place in places],
+    )
+    week = (datetime(2025, 10, 22), datetime(2025, 10, 29))
+
+    return [
+        ("parse: fixture page (100 rows)", lambda: phivolcs.parse_earthquakes(fixture_home), 20),
+        ("parse: synthetic page (5000 rows)", lambda: phivolcs.parse_earthquakes(large_home), 5),
+        ("parse: 1 new row of 5000 (incremental)", lambda: phivolcs.parse_new_earthquakes(large_home, second_link), 20),
+        ("bulletin: fetch and extract", lambda: phivolcs.get_earthquake_additional_info(latest["detail_link"]), 20),
+        ("bulletin: get_info_text", lambda: phivolcs.get_info_text(intensities), 200),
+        ("cache: set 1 KB", lambda: cache_set(small_value), 200),
+        ("cache: get 1 KB (in-process)", lambda: Cache("benchmark-cache", ttl=300).get(), 200),
+        ("cache: set snapshot (compressed)", lambda: cache_set(large_value), 50),
+        ("cache: get snapshot (redis)", cache_get_redis, 50),
+        ("map: generate_earthquake_view", lambda: generate_earthquake_view(latest["latitude"], latest["longitude"]), 1000),
+        ("dashboard: GET /dashboard", lambda: get("/dashboard"), 50),
+        ("dashboard: stored summary stream", lambda: get(summary_url), 50),
+        ("dashboard: GET /api/earthquakes.geojson", lambda: get("/api/earthquakes.geojson"), 50),
+        ("clustering: build one year (60000 synthetic events)", lambda: ClusterEngine(*catalog), 5),
+        ("area: parse location (uncached)", lambda: parse_location.__wrapped__(rows[0][5]), 1000),
+        ("area: earthquakes of a province in a week", lambda: area_index.query("Cebu", None, *week), 1000),
+        ("area: counts per municipality", lambda: area_index.counts("municipality"), 50),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare against (or to save)")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown factor")
+    parser.add_argument("--only", default="", help="only run the benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    benchmarks = build_benchmarks()
+
+    results = {}
+    regressions = []
+
+    print(f"{'benchmark':<42} {'median':>10} {'best':>10} {'baseline':>10}")
+    for name, func, repeat in benchmarks:
+        if args.only not in name:
+            continue
+
+        median, best = measure(func, repeat)
+        results[name] = round(median, 4)
+
+        expected = baseline.get(name)
+        status = ""
+        if expected is not None and median > expected * args.tolerance and median - expected > NOISE_FLOOR:
+            status = "REGRESSION"
+            regressions.append(name)
+
+        expected_text = f"{expected:8.3f}ms" if expected is not None else f"{'-':>10}"
+        print(f"{name:<42} {median:8.3f}ms {best:8.3f}ms {expected_text} {status}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            # benchmarks left out with --only keep their previous baseline
+            json.dump({"python": sys.version.split()[0], "results": {**baseline, **results}}, f, indent=2)
+            f.write("\n")
+        print(f"saved baseline: {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
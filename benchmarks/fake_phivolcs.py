@@ -0,0 +1,194 @@
+import argparse
+import calendar
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# run from anywhere: make the fixtures importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+"""
+Local stand-in of the PHIVOLCS website, serving the fixed and synthetic pages of fixtures/.
+1. /                                              the fixed main page (or a synthetic one, see --rows)
+2. /EQLatest-Monthly/2025/2025_October.html       a monthly archive page, built from the rows of the csv of that month
+3. /2025_Earthquake_Information/October/...html   the fixed bulletin (for every bulletin link)
+Anything else is a 404, like a month that is not archived.
+
+Faults and load can be injected, to see how the app behaves against a slow or failing upstream:
+--latency/--jitter delay every response, --error-rate answers a fraction of the requests with 503,
+and --new-event-interval adds a new earthquake to the top of the main page every few seconds.
+
+usage:
+    python benchmarks/fake_phivolcs.py --port 8000
+    flask --app run backfill --start 2025-10 --end 2025-10 --base-url http://127.0.0.1:8000/
+
+    python benchmarks/fake_phivolcs.py --port 8000 --rows 500 --latency 0.3 --error-rate 0.05 --new-event-interval 30
+    PHIVOLCS_BASE_URL=http://127.0.0.1:8000/ INGESTION_INTERVAL=10 flask --app run run
+"""
+
+# monthly archive page path: year and month name
+MONTHLY_PATTERN = re.compile(r"^/EQLatest-Monthly/(\d{4})/\d{4}_([A-Za-z]+)\.html$")
+
+# bulletin path, with / or \ separators (the links of the pages use \)
+BULLETIN_PATTERN = re.compile(r"^/\d{4}_Earthquake_Information[/\\]")
+
+
+# csv rows grouped by (year, month number), in the csv order (newest first)
+def rows_by_month():
+    months = {}
+    for row in fixtures.csv_rows():
+        parsed = datetime.strptime(row[0], "%d %B %Y - %I:%M %p")
+        months.setdefault((parsed.year, parsed.month), []).append(row)
+    return months
+
+
+class FakePhivolcs:
+    # rows: serve a synthetic main page of that many csv rows instead of the fixed one
+    # latency, jitter: seconds added to every response; error_rate: fraction of the requests answered with 503
+    # new_event_interval: seconds between new earthquakes on the main page (None: the page never changes)
+    def __init__(self, rows=0, latency=0.0, jitter=0.0, error_rate=0.0, new_event_interval=None, seed=None):
+        self.bulletin_html = fixtures.load("phivolcs_bulletin.html")
+        self.months = rows_by_month()
+        # monthly pages are built on first request
+        self.monthly_pages = {}
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        # new earthquakes need a main page built from rows
+        if new_event_interval and not rows:
+            rows = 100
+        self.home_rows = fixtures.csv_rows()[:rows]
+        self.home_html = fixtures.synthetic_home(rows, self.home_rows) if rows else fixtures.load("phivolcs_home.html")
+
+        self.new_event_interval = new_event_interval
+        self.started = time.monotonic()
+        self.new_events = 0
+        self.lock = threading.Lock()
+
+    # add the earthquakes that arrived since the last request (one every new_event_interval seconds)
+    def add_new_events(self):
+        due = int((time.monotonic() - self.started) / self.new_event_interval)
+
+        with self.lock:
+            while self.new_events < due:
+                # a minute after the newest row (the date-time is the identity of the bulletin link)
+                newest = datetime.strptime(self.home_rows[0][0], "%d %B %Y - %I:%M %p")
+                date_time = max(datetime.now().replace(second=0, microsecond=0), newest + timedelta(minutes=1))
+
+                # somewhere near a known earthquake
+                _, latitude, longitude, depth, _, location = self.random.choice(self.home_rows)
+                self.home_rows.insert(0, [
+                    date_time.strftime("%d %B %Y - %I:%M %p"),
+                    f"{float(latitude) + self.random.uniform(-0.05, 0.05):.2f}",
+                    f"{float(longitude) + self.random.uniform(-0.05, 0.05):.2f}",
+                    depth,
+                    f"{self.random.uniform(1.0, 5.5):.1f}",
+                    location,
+                ])
+                # the main page keeps the same number of rows, like the real one
+                self.home_rows.pop()
+                self.new_events += 1
+                self.home_html = fixtures.synthetic_home(len(self.home_rows), self.home_rows)
+
+    # (status, html) of a request, with the injected latency and errors
+    def respond(self, path):
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 503, "Service Unavailable"
+
+        return self.page(path)
+
+    # (status, html) of a path
+    def page(self, path):
+        path = path.split("?", 1)[0].replace("%5C", "\\")
+
+        if path in ("/", "/index.html"):
+            if self.new_event_interval:
+                self.add_new_events()
+            return 200, self.home_html
+
+        match = MONTHLY_PATTERN.match(path)
+        if match:
+            year = int(match.group(1))
+            month_names = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+            month = month_names.get(match.group(2).lower())
+            rows = self.months.get((year, month))
+            if not rows:
+                return 404, "Not Found"
+
+            if (year, month) not in self.monthly_pages:
+                self.monthly_pages[(year, month)] = fixtures.synthetic_home(len(rows), rows)
+            return 200, self.monthly_pages[(year, month)]
+
+        if BULLETIN_PATTERN.match(path):
+            return 200, self.bulletin_html
+
+        return 404, "Not Found"
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive connections, like the real site
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            status, html = site.respond(self.path)
+            body = html.encode("utf-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # keep the console quiet
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in of the PHIVOLCS website")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--rows", type=int, default=0, help="serve a synthetic main page of this many rows")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of the requests answered with 503")
+    parser.add_argument("--new-event-interval", type=float, default=None,
+                        help="seconds between new earthquakes on the main page")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the injected errors and new earthquakes")
+    args = parser.parse_args()
+
+    site = FakePhivolcs(
+        rows=args.rows,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        new_event_interval=args.new_event_interval,
+        seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(site))
+    print(f"Serving fake PHIVOLCS on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import csv
+import glob
+import os
+import re
+from datetime import datetime
+
+"""
+Fixed, captured and synthetic PHIVOLCS pages for the offline benchmarks.
+phivolcs_home.html and phivolcs_bulletin.html are fixed pages written in the PHIVOLCS markup
+(Word-generated MsoNormalTable html) from the csv rows, not live captures.
+synthetic_home() builds a main page of any size from the monthly csv shipped with the node api,
+edge_cases() the broken markup both parser backends must read the same way.
+
+Live pages saved in captured/ are used as well, e.g.:
+    curl -s https://earthquake.phivolcs.dost.gov.ph/ -o benchmarks/fixtures/captured/home_$(date +%Y%m%d).html
+"""
+
+# folder of this file, where the fixed pages are saved
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# folder of the live pages captured from phivolcs (optional)
+CAPTURED_DIR = os.path.join(FIXTURES_DIR, "captured")
+
+# monthly csv shipped with the node api, used as the source of synthetic rows
+CSV_PATH = os.path.join(FIXTURES_DIR, "../../app/api/phivolcs/data/phivolcs_earthquake_data_10_2025.csv")
+
+
+# read a fixed page by file name
+def load(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+# {file name: html} of the captured live pages, empty if none were saved
+def captured():
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(CAPTURED_DIR, "*.html"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+
+# read the csv rows (date-time, latitude, longitude, depth, magnitude, location), newest first
+def csv_rows():
+    with open(CSV_PATH, encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+# bulletin path of a row, in the same layout as the phivolcs archive
+def bulletin_path(date_time):
+    parsed = datetime.strptime(date_time, "%d %B %Y - %I:%M %p")
+    return f"{parsed:%Y}_Earthquake_Information\\{parsed:%B}\\{parsed:%Y_%m%d_%H%M}00_B1F.html"
+
+
+# html of one earthquake row, in the same markup as the phivolcs main page
+def row_html(date_time, latitude, longitude, depth, magnitude, location):
+    cell = "<td valign=top><p class=MsoNormal align=center style='text-align:center'><span style='font-size:9.0pt'>{}</span></p></td>"
+    return (
+        "<tr style='height:15.0pt'>\n"
+        f"  <td width=171 valign=top><p class=MsoNormal><span style='font-size:9.0pt'><a href=\"{bulletin_path(date_time)}\"><span style='color:windowtext'>{date_time}</span></a></span></p></td>\n"
+        f"  {cell.format(latitude)}\n"
+        f"  {cell.format(longitude)}\n"
+        f"  {cell.format(depth)}\n"
+        f"  {cell.format(magnitude)}\n"
+        f"  <td width=305 valign=top><p class=MsoNormal><span style='font-size:9.0pt'>&nbsp;{location.replace('°', '&deg;')}</span></p></td>\n"
+        " </tr>"
+    )
+
+
+# build a main page with the given csv rows (repeated if more rows are asked than the csv has)
+def synthetic_home(count=500, rows=None):
+    rows = rows if rows is not None else csv_rows()
+    rows = [rows[i % len(rows)] for i in range(count)]
+
+    return "\n".join([
+        "<html><head><title>PHIVOLCS Latest Earthquake Information</title></head><body>",
+        "<table class=MsoNormalTable border=0><tr><td><p class=MsoNormal>Latest Earthquake Information</p></td></tr></table>",
+        "<table class=MsoNormalTable border=1 cellspacing=0 cellpadding=0>",
+        "<tr><td><p class=MsoNormal align=center><b><span>Date - Time<br>(Philippine Time)</span></b></p></td>"
+        "<td><p><b>Latitude<br>(&ordm;N)</b></p></td><td><p><b>Longitude<br>(&ordm;E)</b></p></td>"
+        "<td><p><b>Depth<br>(km)</b></p></td><td><p><b>Mag</b></p></td><td><p><b>Location</b></p></td></tr>",
+        *(row_html(*row) for row in rows),
+        "</table></body></html>",
+    ])
+
+
+# {name: html} of broken markup seen on word-generated pages, as main pages with a few csv rows
+def edge_cases():
+    rows = csv_rows()[:6]
+    header = "<tr><td>Date - Time</td><td>Latitude</td><td>Longitude</td><td>Depth</td><td>Mag</td><td>Location</td></tr>"
+
+    def page(body):
+        return f"<html><body><table class=MsoNormalTable border=1>{header}{body}</table></body></html>"
+
+    # a table inside a cell of a data row, with its own header and rows
+    inner = f"<table class=MsoNormalTable>{header}{row_html(*rows[1])}{row_html(*rows[2])}</table>"
+    nested = page(
+        row_html(*rows[0]).replace("</p></td>\n", f"</p>{inner}</td>\n", 1)
+        + row_html(*rows[3])
+    )
+
+    # rows (and cells) without their closing tags
+    unclosed = page("".join(row_html(*row).replace("</tr>", "").replace("</td>", "") for row in rows[:3]))
+
+    # whitespace and line breaks around the values, non-breaking spaces, upper case tags
+    stray_whitespace = page("".join(
+        row_html(*row).replace("<span style='font-size:9.0pt'>", "<span style='font-size:9.0pt'>\n   ")
+        .replace("</span></p>", " &nbsp;\n</span></p>").replace("<td", "<TD").replace("</td>", "</TD>")
+        for row in rows[:3]
+    ))
+
+    # a date-time without its bulletin link
+    no_link = page(re.sub(r"<a [^>]*>(.*?)</a>", r"\1", row_html(*rows[0])) + row_html(*rows[1]))
+
+    return {
+        "nested tables": nested,
+        "unclosed rows": unclosed,
+        "stray whitespace": stray_whitespace,
+        "missing link": no_link,
+    }
@@ -0,0 +1,156 @@
+import argparse
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+import requests
+
+"""
+Load generator for a running app: many concurrent users sign in and open the dashboard again and again,
+reporting the throughput and the latency percentiles (p50, p90, p99) of every endpoint.
+Each user is one requests session (its own cookies and keep-alive connection), in its own thread.
+
+Run the app against the local stand-in of PHIVOLCS, so the load never reaches the real site:
+    python benchmarks/fake_phivolcs.py --port 8000 --rows 500 --new-event-interval 30
+    PHIVOLCS_BASE_URL=http://127.0.0.1:8000/ INGESTION_INTERVAL=10 flask --app run run --port 5000
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --users 50 --duration 60
+
+--parts also loads what the browser loads after the page (summary stream, geojson feed),
+--output saves the report as json, to compare configurations (workers, caches, upstream latency).
+"""
+
+# password of the load test users (alphanumeric, at least 12 characters, see the register route)
+PASSWORD = "loadtest_password_1"
+
+# urls loaded by the browser after the dashboard (progressive parts of the page)
+PART_PATTERN = re.compile(r'data-(?:stream|geojson)-url="([^"]+)"')
+
+# the summary stream may wait for the model; do not let one request hang a user forever
+TIMEOUT = 30 # seconds
+
+
+# latency percentile (0-100) of sorted latencies, nearest rank
+def percentile(latencies, p):
+    if not latencies:
+        return None
+    rank = max(int(round(p / 100 * len(latencies))) - 1, 0)
+    return latencies[min(rank, len(latencies) - 1)]
+
+
+# latencies and errors per endpoint, shared by all users
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    # {endpoint: {"requests", "errors", "throughput", "p50", "p90", "p99", "max"}}, latencies in milliseconds
+    def report(self, elapsed):
+        report = {}
+        for endpoint, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            report[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput": round(len(latencies) / elapsed, 2),
+                **{f"p{p}": round(percentile(latencies, p) * 1000, 2) for p in (50, 90, 99)},
+                "max": round(latencies[-1] * 1000, 2),
+            }
+        return report
+
+
+# time one request; returns the response, or None if it failed to connect
+def timed_request(recorder, endpoint, method, url, session, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=TIMEOUT, **kwargs)
+        # read the whole body (streams included), as a browser would
+        response.content
+    except requests.RequestException:
+        recorder.record(endpoint, time.perf_counter() - start, False)
+        return None
+
+    recorder.record(endpoint, time.perf_counter() - start, response.ok)
+    return response
+
+
+# create the load test users (an existing user is fine: the register page answers with an error, not a failure)
+def register_users(url, users):
+    with requests.Session() as session:
+        for user in range(users):
+            session.post(urljoin(url, "/register"), data={"username": f"loadtest{user}", "password": PASSWORD})
+
+
+# one user: sign in, then open the dashboard until the deadline
+def run_user(url, user, deadline, recorder, parts, think_time):
+    with requests.Session() as session:
+        response = timed_request(
+            recorder, "POST /signin", "POST", urljoin(url, "/signin"), session,
+            data={"username": f"loadtest{user}", "password": PASSWORD}, allow_redirects=False,
+        )
+        # a successful sign in redirects to the dashboard
+        if response is None or response.status_code != 302:
+            return
+
+        while time.monotonic() < deadline:
+            response = timed_request(recorder, "GET /dashboard", "GET", urljoin(url, "/dashboard"), session)
+
+            if parts and response is not None and response.ok:
+                for part in PART_PATTERN.findall(response.text):
+                    part = part.replace("&amp;", "&")
+                    timed_request(recorder, f"GET {part.split('?', 1)[0]}", "GET", urljoin(url, part), session)
+
+            if think_time:
+                time.sleep(think_time)
+
+
+def print_report(report, users, elapsed):
+    print(f"{users} users for {elapsed:.1f}s")
+    print(f"{'endpoint':<36} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for endpoint, stats in sorted(report.items()):
+        print(
+            f"{endpoint:<36} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput']:>8.1f} "
+            f"{stats['p50']:>7.1f}ms {stats['p90']:>7.1f}ms {stats['p99']:>7.1f}ms {stats['max']:>7.1f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of /signin and /dashboard")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="base url of the running app")
+    parser.add_argument("--users", type=int, default=20, help="number of concurrent users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds each user waits between dashboards")
+    parser.add_argument("--parts", action="store_true", help="also load the summary stream and the geojson feed")
+    parser.add_argument("--output", default=None, help="save the report to this json file")
+    args = parser.parse_args()
+
+    register_users(args.url, args.users)
+
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + args.duration
+
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        for user in range(args.users):
+            executor.submit(run_user, args.url, user, deadline, recorder, args.parts, args.think_time)
+
+    elapsed = time.monotonic() - start
+    report = recorder.report(elapsed)
+    print_report(report, args.users, elapsed)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"url": args.url, "users": args.users, "duration": round(elapsed, 2), "results": report}, f, indent=2)
+        print(f"saved report: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import tempfile
+import time
+
+# run from anywhere: make the app package and the fixtures importable
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, ".."))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fakeredis
+import redis
+import fixtures
+
+"""
+Offline environment for the benchmarks: the app runs without network, redis server or gemini api key.
+1. redis is a fakeredis server in memory (patched in before the app creates its redis client)
+2. http requests to phivolcs are answered with the fixed (or synthetic) pages of fixtures/
+3. the gemini client is a stub answering with fixed summaries, after an optional simulated latency
+4. the database is a temporary sqlite file, and the ingestion thread is disabled
+
+Call setup() before importing anything from the app.
+"""
+
+# username and password of the benchmark user
+USERNAME = "benchmark"
+PASSWORD = "benchmark_password"
+
+
+# a response of the stubbed http session
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+
+# http session answering with fixture pages: bulletins get the fixed bulletin, everything else the main page
+class FakeSession:
+    def __init__(self, home_html, bulletin_html):
+        self.home_html = home_html
+        self.bulletin_html = bulletin_html
+
+    def get(self, url, headers=None, timeout=None, **kwargs):
+        if "_Earthquake_Information" in url:
+            return FakeResponse(self.bulletin_html)
+        return FakeResponse(self.home_html)
+
+
+# a response of the stubbed gemini client
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+# gemini models stub: fixed summaries, one per earthquake of the prompt, after `latency` seconds
+class FakeGeminiModels:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, model, config, contents):
+        self.calls += 1
+        time.sleep(self.latency)
+
+        # batch prompts ask for a json array, one summary per earthquake
+        if config.response_mime_type == "application/json":
+            count = contents.count("EARTHQUAKE ")
+            return FakeGeminiResponse("[" + ",".join(f'"Summary {number}."' for number in range(count)) + "]")
+        return FakeGeminiResponse("Summary.")
+
+    def generate_content_stream(self, model, config, contents):
+        self.calls += 1
+        for chunk in ("A magnitude ", "earthquake was ", "recorded."):
+            time.sleep(self.latency / 3)
+            yield FakeGeminiResponse(chunk)
+
+
+class FakeGeminiClient:
+    def __init__(self, latency=0.0):
+        self.models = FakeGeminiModels(latency)
+
+
+# patch redis, create the app on a temporary database, and stub http and gemini
+# returns (app, session, gemini) so benchmarks can change the served pages or the gemini latency
+def setup(home_html=None, gemini_latency=0.0):
+    # one in-memory redis server for the whole process
+    fake_redis = fakeredis.FakeRedis()
+    redis.Redis = lambda *args, **kwargs: fake_redis
+
+    import config
+    config.DevelopmentConfig.INGESTION_THREAD = False
+    config.DevelopmentConfig.SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.sqlite")
+
+    from app.api import client, googleai
+
+    session = FakeSession(home_html or fixtures.load("phivolcs_home.html"), fixtures.load("phivolcs_bulletin.html"))
+    client.session = session
+
+    gemini = FakeGeminiClient(gemini_latency)
+    googleai.client = gemini
+
+    from app import create_app
+    app = create_app()
+
+    return app, session, gemini
+
+
+# signed in test client of the app
+def signed_in_client(app):
+    test_client = app.test_client()
+    test_client.post("/register", data={"username": USERNAME, "password": PASSWORD})
+    test_client.post("/signin", data={"username": USERNAME, "password": PASSWORD})
+    return test_client
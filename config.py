@@ -5,3 +5,20 @@ class DevelopmentConfig:
     SECRET_KEY = os.getenv("SECRET_KEY", "maiks")
     SQLALCHEMY_DATABASE_URI = "sqlite:///db.sqlite"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # poll phivolcs from a background thread of every app process that serves requests
+    # set INGESTION_THREAD=0 when running `flask --app run ingest` as a separate process
+    # (the threads also stand by on their own while that process is running)
+    INGESTION_THREAD = os.getenv("INGESTION_THREAD", "1") == "1"
+    # seconds between scrapes of the phivolcs feed (shorter against a local stand-in, for load tests)
+    INGESTION_INTERVAL = int(os.getenv("INGESTION_INTERVAL", 60))
+    # summarize new earthquakes in the ingestion worker, instead of streaming them on the first dashboard view
+    SUMMARY_PIPELINE = True
+    # push new earthquakes to open dashboards (/api/events/stream); off by default, since every open dashboard
+    # holds one server thread for as long as it is open: only enable it with a threaded or gevent server
+    # (e.g. `gunicorn -k gevent run:app`), never with one sync worker per request
+    LIVE_EVENTS = os.getenv("LIVE_EVENTS", "0") == "1"
+    # maximum number of dashboards connected to the live stream per process (the others get a 503)
+    LIVE_EVENTS_MAX_CLIENTS = int(os.getenv("LIVE_EVENTS_MAX_CLIENTS", 100))
+    # let browsers cache the static files (the map and summary scripts) for a day
+    SEND_FILE_MAX_AGE_DEFAULT = 24 * 60 * 60